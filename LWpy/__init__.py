@@ -1,12 +1,26 @@
 from .lic import read_stream
 from .lic import write_stream
+from .lic import spline_blob
+from .spline_store import spline_store
 from .block import merge_blocks
 from .block import block_equal
+from .block import block_merger
 from .generator import generator
 from .generator import volume_generator
+from .generator import geometry_error
 from .generator import ranged_generator
 from .interactions import interaction
 from .interactions import interactions
 from .interactions import interaction_model
 from .interactions import get_standard_interactions
 from .earth import earth
+from .numpy_earth import numpy_earth
+from .vector import vector3
+from .event_batch import event_batch
+from .weighter import weighter
+from .parallel import parallel
+from .event_file import event_file
+from .event_file import weight_file
+from .config_cache import config_cache
+from .column_depth_table import column_depth_table
+from .instrument import profiler
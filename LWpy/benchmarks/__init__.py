@@ -0,0 +1,6 @@
+from .synthetic import make_events
+from .synthetic import make_blocks
+from .synthetic import make_lic
+from .benchmark import measure
+from .benchmark import suite
+from .benchmark import main
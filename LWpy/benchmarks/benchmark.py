@@ -0,0 +1,246 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from ..lic import read_stream
+from ..lic import write_stream
+from ..block import merge_blocks
+from ..generator import volume_generator
+from ..generator import ranged_generator
+from ..interactions import interaction_model
+from ..interactions import get_standard_interactions
+from .synthetic import make_events
+from .synthetic import make_blocks
+from .synthetic import make_lic
+from .synthetic import parse_final_state
+from .synthetic import default_final_states
+from .synthetic import default_earth_model_params
+
+def measure(run, prepare=None, items=1, repeat=3):
+    # Best wall time of repeat calls of run(*prepare()) and the peak memory allocated by one extra call
+    # prepare is not timed, it provides fresh arguments so that no call reuses caches of the previous one
+    if prepare is None:
+        prepare = tuple
+    times = []
+    for i in range(repeat):
+        args = prepare()
+        gc.collect()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    args = prepare()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    seconds = min(times)
+    return {
+            "items": items,
+            "repeat": repeat,
+            "seconds": seconds,
+            "mean_seconds": float(np.mean(times)),
+            "items_per_second": items / seconds if seconds > 0 else float('inf'),
+            "peak_memory_bytes": peak,
+            }
+
+class suite:
+    # Benchmarks of the probability terms and the .lic I/O on synthetic events and configurations
+    # Every component returns (run, prepare, items, unit) for measure
+    components = [
+            "generator.prob",
+            "volume_generator.prob_pos",
+            "ranged_generator.prob",
+            "ranged_generator.prob_pos",
+            "interaction_model.prob_kinematics",
+            "interaction_model.prob_final_state",
+            "interaction_model.prob_interaction",
+            "interaction_model.prob_pos",
+            "read_stream.read",
+            "read_stream.read_index",
+            "write_stream.write",
+            "merge_blocks",
+            ]
+
+    def __init__(self, events=100000, blocks=64, distinct=8, energy_range=(1e2, 1e6), zenith_range=(0.0, np.pi),
+            final_states=default_final_states, earth_model_params=default_earth_model_params, earth_backend="numpy",
+            seed=0, workdir=None):
+        self.n_events = events
+        self.n_blocks = blocks
+        self.distinct = distinct
+        self.energy_range = energy_range
+        self.zenith_range = zenith_range
+        self.final_states = final_states
+        self.earth_model_params = earth_model_params
+        self.earth_backend = earth_backend
+        self.seed = seed
+        self.own_workdir = workdir is None
+        self.workdir = tempfile.mkdtemp(prefix='lwpy_benchmark_') if workdir is None else workdir
+        self.events = make_events(events, energy_range=energy_range, zenith_range=zenith_range, final_states=final_states, seed=seed)
+        self.blocks = make_blocks(max(distinct, 2), distinct=max(distinct, 2), energy_range=energy_range, zenith_range=zenith_range, final_states=final_states)
+        self.lic = None
+        self.model = None
+
+    def close(self):
+        if self.own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def parameters(self):
+        return {
+                "events": self.n_events,
+                "blocks": self.n_blocks,
+                "distinct": self.distinct,
+                "energy_range": list(self.energy_range),
+                "zenith_range": list(self.zenith_range),
+                "final_states": [list(f) for f in self.final_states],
+                "earth_backend": self.earth_backend,
+                "seed": self.seed,
+                }
+
+    def fresh_events(self):
+        # A copy is a new array, so the interaction_model cache keyed by the events does not hit
+        return (self.events.copy(),)
+
+    def block(self, block_name):
+        return [b for b in self.blocks if b[0] == block_name][0]
+
+    def lic_file(self):
+        if self.lic is None:
+            self.lic = os.path.join(self.workdir, 'synthetic.lic')
+            make_lic(self.lic, self.n_blocks, distinct=self.distinct, energy_range=self.energy_range, zenith_range=self.zenith_range, final_states=self.final_states)
+        return self.lic
+
+    def interaction_model(self):
+        if self.model is None:
+            self.model = interaction_model(get_standard_interactions(), self.earth_model_params, earth_backend=self.earth_backend)
+        return self.model
+
+    def ranged_generator(self):
+        return ranged_generator(self.block("RangedInjectionConfiguration"), self.earth_model_params, earth_backend=self.earth_backend)
+
+    def volume_ranges(self):
+        gen = volume_generator(self.block("VolumeInjectionConfiguration"))
+        first_pos, last_pos = gen.get_considered_range(self.events)
+        return lambda: (self.events.copy(), first_pos, last_pos)
+
+    def component(self, name):
+        n = self.n_events
+        if name == "generator.prob":
+            gen = volume_generator(self.block("VolumeInjectionConfiguration"))
+            return gen.prob, self.fresh_events, n, "events"
+        elif name == "volume_generator.prob_pos":
+            gen = volume_generator(self.block("VolumeInjectionConfiguration"))
+            return gen.prob_pos, self.fresh_events, n, "events"
+        elif name == "ranged_generator.prob":
+            gen = self.ranged_generator()
+            return gen.prob, self.fresh_events, n, "events"
+        elif name == "ranged_generator.prob_pos":
+            gen = self.ranged_generator()
+            first_pos, last_pos = gen.get_considered_range(self.events)
+            return gen.prob_pos, lambda: (self.events.copy(), first_pos, last_pos), n, "events"
+        elif name == "interaction_model.prob_kinematics":
+            return self.interaction_model().prob_kinematics, self.fresh_events, n, "events"
+        elif name == "interaction_model.prob_final_state":
+            return self.interaction_model().prob_final_state, self.fresh_events, n, "events"
+        elif name == "interaction_model.prob_interaction":
+            return self.interaction_model().prob_interaction, self.volume_ranges(), n, "events"
+        elif name == "interaction_model.prob_pos":
+            return self.interaction_model().prob_pos, self.volume_ranges(), n, "events"
+        elif name == "read_stream.read":
+            spline_dir = os.path.join(self.workdir, 'splines')
+            if not os.path.isdir(spline_dir):
+                os.makedirs(spline_dir)
+            def run(fname):
+                with read_stream(fname, spline_dir=spline_dir) as s:
+                    s.read()
+            return run, lambda: (self.lic_file(),), self.n_blocks, "blocks"
+        elif name == "read_stream.read_index":
+            def run(fname):
+                with read_stream(fname, index_only=True) as s:
+                    s.read()
+            return run, lambda: (self.lic_file(),), self.n_blocks, "blocks"
+        elif name == "write_stream.write":
+            with read_stream(self.lic_file(), index_only=True) as s:
+                blocks = s.read()
+            fname = os.path.join(self.workdir, 'written.lic')
+            return write_stream(fname).write, lambda: (blocks,), self.n_blocks, "blocks"
+        elif name == "merge_blocks":
+            with read_stream(self.lic_file(), index_only=True) as s:
+                blocks = s.read()
+            return merge_blocks, lambda: (blocks,), self.n_blocks, "blocks"
+        raise ValueError("Unknown benchmark " + str(name) + ", options are " + str(suite.components))
+
+    def run(self, names=None, repeat=3, log=None):
+        # Results by component name
+        if names is None:
+            names = suite.components
+        results = dict()
+        for name in names:
+            run, prepare, items, unit = self.component(name)
+            res = measure(run, prepare, items=items, repeat=repeat)
+            res["unit"] = unit
+            results[name] = res
+            if log is not None:
+                log.write(name + ": " + ("%.4g" % res["items_per_second"]) + " " + unit + "/s, peak " + str(res["peak_memory_bytes"]) + " bytes\n")
+        return results
+
+def report(results, parameters):
+    return {
+            "version": 1,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "parameters": parameters,
+            "results": results,
+            }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark LWpy on synthetic events and .lic files, the report is written as JSON")
+    parser.add_argument("components", nargs="*", help="components to run, all by default: " + ", ".join(suite.components))
+    parser.add_argument("-n", "--events", type=int, default=100000, help="number of synthetic events")
+    parser.add_argument("-b", "--blocks", type=int, default=64, help="number of injection blocks in the synthetic .lic file")
+    parser.add_argument("--distinct", type=int, default=8, help="number of distinct injection configurations among the blocks")
+    parser.add_argument("--energy-range", type=float, nargs=2, default=[1e2, 1e6], metavar=("MIN", "MAX"), help="energy range [GeV]")
+    parser.add_argument("--zenith-range", type=float, nargs=2, default=[0.0, np.pi], metavar=("MIN", "MAX"), help="zenith range [rad]")
+    parser.add_argument("--final-state", action="append", type=parse_final_state, help="particle:final_type_0:final_type_1, e.g. NuMu:MuMinus:Hadrons, may be repeated")
+    parser.add_argument("--earth-backend", default="numpy", help="earth model backend of the ranged generator and the interaction model")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed calls per component, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="JSON report, standard output by default")
+    args = parser.parse_args(argv)
+    if args.events < 1 or args.blocks < 1 or args.distinct < 1 or args.repeat < 1:
+        parser.error("events, blocks, distinct and repeat have to be positive")
+    for name in args.components:
+        if name not in suite.components:
+            parser.error("unknown component " + name)
+
+    final_states = default_final_states if args.final_state is None else args.final_state
+    with suite(events=args.events, blocks=args.blocks, distinct=args.distinct, energy_range=tuple(args.energy_range),
+            zenith_range=tuple(args.zenith_range), final_states=final_states, earth_backend=args.earth_backend, seed=args.seed) as s:
+        results = s.run(args.components or None, repeat=args.repeat, log=sys.stderr)
+        data = json.dumps(report(results, s.parameters()), indent=1, sort_keys=True)
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import numpy as np
+import LeptonInjector
+from ..lic import write_stream
+from ..interactions import get_standard_interactions
+from ..interactions import path
+
+ParticleType = LeptonInjector.Particle.ParticleType
+
+# Fields of the events accepted by the generators and the interaction model
+event_names = (
+        'energy',
+        'zenith',
+        'azimuth',
+        'bjorken_x',
+        'bjorken_y',
+        'final_type_0',
+        'final_type_1',
+        'particle',
+        'x',
+        'y',
+        'z',
+        'total_column_depth',
+        )
+
+# (particle, final_type_0, final_type_1)
+default_final_states = ((int(ParticleType.NuMu), int(ParticleType.MuMinus), int(ParticleType.Hadrons)),)
+
+default_earth_model_params = [
+        "DUNE",
+        path + "earthparams/",
+        ["PREM_dune"],
+        ["Standard"],
+        "NoIce",
+        20.0*LeptonInjector.Constants.degrees,
+        1480.0*LeptonInjector.Constants.m]
+
+def parse_final_state(s):
+    # "NuMu:MuMinus:Hadrons" -> (14, 13, -2000001006)
+    names = s.split(':')
+    if len(names) != 3:
+        raise ValueError("Expected particle:final_type_0:final_type_1, got " + s)
+    try:
+        return tuple(int(getattr(ParticleType, n)) for n in names)
+    except AttributeError as e:
+        raise ValueError("Unknown particle type in " + s)
+
+def make_events(n, energy_range=(1e2, 1e6), zenith_range=(0.0, np.pi), final_states=default_final_states,
+        radius=800.0, height=1000.0, seed=None):
+    # Events drawn uniformly in log10(energy), cos(zenith), azimuth, log10(x), log10(y) and inside a cylinder
+    # Final states are assigned round robin
+    rng = np.random.RandomState(seed)
+    events = np.zeros(n, dtype=[(k, 'i4' if k in ['final_type_0', 'final_type_1', 'particle'] else 'f8') for k in event_names])
+    events["energy"] = 10**rng.uniform(np.log10(energy_range[0]), np.log10(energy_range[1]), n)
+    events["zenith"] = np.arccos(rng.uniform(np.cos(zenith_range[1]), np.cos(zenith_range[0]), n))
+    events["azimuth"] = rng.uniform(0, 2*np.pi, n)
+    events["bjorken_x"] = 10**rng.uniform(-2, 0, n)
+    events["bjorken_y"] = 10**rng.uniform(-2, 0, n)
+    final_states = np.array(final_states, dtype=int)
+    state = final_states[np.arange(n) % len(final_states)]
+    events["particle"] = state[:,0]
+    events["final_type_0"] = state[:,1]
+    events["final_type_1"] = state[:,2]
+    r = radius * np.sqrt(rng.uniform(0, 1, n))
+    phi = rng.uniform(0, 2*np.pi, n)
+    events["x"] = r * np.cos(phi)
+    events["y"] = r * np.sin(phi)
+    events["z"] = rng.uniform(-height/2.0, height/2.0, n)
+    return events
+
+def cross_section_files(final_state):
+    # Standard differential and total cross section splines of a final state
+    particle = final_state[0]
+    signature = (particle,) + tuple(sorted(final_state[1:]))
+    for i in get_standard_interactions():
+        if i.signature == signature:
+            return i.differential_xs, i.total_xs
+    raise ValueError("No standard interaction for " + str(final_state))
+
+def particle_enum():
+    return ('Particle::ParticleType', dict((name, int(v)) for name, v in ParticleType.names.items()))
+
+def make_blocks(n_blocks, distinct=None, events=1000, energy_range=(1e2, 1e6), zenith_range=(0.0, np.pi),
+        final_states=default_final_states, radius=800.0, height=1000.0, length=1200.0, ranged=True):
+    # An EnumDef block followed by n_blocks injection configurations cycling through distinct different ones,
+    # volume and ranged in turn if ranged is True
+    # Spline names are absolute paths, write them with any spline_dir
+    if distinct is None:
+        distinct = n_blocks
+    blocks = [('EnumDef', 1, particle_enum())]
+    for i in range(n_blocks):
+        k = i % distinct
+        final_state = final_states[k % len(final_states)]
+        differential_xs, total_xs = cross_section_files(final_state)
+        d = {
+                "events": events,
+                "energy_min": energy_range[0],
+                "energy_max": energy_range[1],
+                "powerlaw_index": 2.0 + 0.01 * (k // len(final_states)),
+                "azimuth_min": 0.0,
+                "azimuth_max": 2*np.pi,
+                "zenith_min": zenith_range[0],
+                "zenith_max": zenith_range[1],
+                "final_type_0": final_state[1],
+                "final_type_1": final_state[2],
+                "totalCrossSection": total_xs,
+                "differentialCrossSection": differential_xs,
+                "radius": radius,
+                }
+        if ranged and k % 2 == 1:
+            d["length"] = length
+            blocks.append(('RangedInjectionConfiguration', 1, d))
+        else:
+            d["height"] = height
+            blocks.append(('VolumeInjectionConfiguration', 1, d))
+    return blocks
+
+def make_lic(fname, n_blocks, **kwargs):
+    # Write a synthetic .lic file, the cross section splines are embedded in every block
+    blocks = make_blocks(n_blocks, **kwargs)
+    write_stream(fname).write(blocks)
+    return blocks
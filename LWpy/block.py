@@ -1,5 +1,4 @@
-import numpy as np
-import functools
+from .lic import read_stream
 
 def chunk(lst, n):
     """Yield successive n-sized chunks from lst."""
@@ -36,37 +35,59 @@ def block_merge(block_0, block_1):
         d.update({"events": d0["events"]+d1["events"]})
     return s0, v0, d
 
+def block_key(block):
+    # Hashable key identifying blocks that can be merged, i.e. everything but the number of events
+    s, v, d = block
+    if s == "EnumDef":
+        name, d = d
+        return (s, v, name, tuple(sorted(d.items())))
+    return (s, v, tuple(sorted((k, d[k]) for k in d.keys() if k != 'events')))
+
 def block_equal(block_0, block_1):
-    s0, v0, d0 = block_0
-    s1, v1, d1 = block_1
-    if v0 != v1:
-        return False
-    if s0 != s1:
-        return False
-    if s0 == "VolumeInjectionConfiguration" or s0 == "RangedInjectionConfiguration":
-        pass
-    elif s0 == "EnumDef":
-        name0, d0 = d0
-        name1, d1 = d1
-        if name0 != name1:
-            return False
-    k_d0 = sorted([k for k in d0.keys() if k != 'events'])
-    k_d1 = sorted([k for k in d1.keys() if k != 'events'])
-    if len(k_d0) != len(k_d1):
-        return False
-    keys = np.unique(k_d0 + k_d1)
-    if len(keys) != len(k_d0):
-        return False
-    return functools.reduce(lambda a,b: a and b, [d0[k]==d1[k] for k in keys])
+    return block_key(block_0) == block_key(block_1)
 
-def merge_blocks(blocks):
-    block_lists = [[b] for b in blocks]
-    while len(block_lists) > 1:
-        next_block_lists = []
-        for c in chunk(block_lists, 2):
+class block_merger:
+    # Merges blocks in one pass, keeping one block per key in order of first occurrence
+    # Blocks can be added incrementally, e.g. file by file
+    def __init__(self):
+        self.merged = dict()
+
+    def add(self, block):
+        key = block_key(block)
+        if key in self.merged:
+            self.merged[key] = block_merge(self.merged[key], block)
+        else:
+            self.merged[key] = block
+        return key
+
+    def add_blocks(self, blocks):
+        return [self.add(block) for block in blocks]
+
+    def add_files(self, fnames, spline_dir='./', index_only=True):
+        # Splines stay in the input files unless index_only is False
+        for fname in fnames:
+            with read_stream(fname, spline_dir=spline_dir, index_only=index_only) as s:
+                self.add_blocks(s.read())
+
+    def blocks(self):
+        return list(self.merged.values())
+
+def merge_order(keys):
+    # Order of the keys in the result of the pairwise tournament of pairwise_merge
+    key_lists = [[k] for k in keys]
+    while len(key_lists) > 1:
+        next_key_lists = []
+        for c in chunk(key_lists, 2):
             if len(c) == 1:
-                next_block_lists.append(c[0])
+                next_key_lists.append(c[0])
             elif len(c) == 2:
-                next_block_lists.append(pairwise_merge(c[0], c[1], block_equal, block_merge))
-        block_lists = next_block_lists
-    return block_lists[0]
+                k0 = set(c[0])
+                k1 = set(c[1])
+                next_key_lists.append([k for k in c[0] if k in k1] + [k for k in c[0] if k not in k1] + [k for k in c[1] if k not in k0])
+        key_lists = next_key_lists
+    return key_lists[0] if len(key_lists) > 0 else []
+
+def merge_blocks(blocks):
+    merger = block_merger()
+    keys = merger.add_blocks(blocks)
+    return [merger.merged[k] for k in merge_order(keys)]
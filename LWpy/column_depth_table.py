@@ -0,0 +1,204 @@
+import numpy as np
+import LeptonInjector
+from .vector import vector3
+
+class column_depth_table:
+    # Column depth D(b, r) of straight lines through a spherically symmetric earth, tabulated over the
+    # impact parameter b and the radius r on a grid with nodes on every layer boundary
+    # Column depths between points are differences, distances for a column depth are found by bisection
+    def __init__(self, earth, bins=1024, r_bins=1<<16, steps=8, iterations=50):
+        self.earth = earth
+        self.atmo_radius = earth.earthModel.GetAtmoRadius()
+        self.center = self.earth_center(earth)
+        self.iterations = iterations
+
+        # Radial density profile, sampled on both sides of every layer boundary so that the
+        # interpolated profile keeps the discontinuities
+        r = np.linspace(0, self.atmo_radius, r_bins)
+        rho, rho_e = self.radial_density(r)
+        boundaries = self.layer_boundaries(r, rho, rho_e)
+        r = np.sort(np.concatenate([r, boundaries * (1.0 - 1e-12), boundaries * (1.0 + 1e-12)]))
+        rho, rho_e = self.radial_density(r)
+
+        self.shells, self.shell_start = self.radial_shells(boundaries, bins)
+        grid = self.radial_grid()
+        self.grid = grid
+        self.bins = len(grid)
+        self.column = []
+        self.local_density = []
+        # Midpoint rule on each grid interval along the line, the integrand is smooth within the intervals
+        w = (np.arange(steps) + 0.5) / steps
+        for density in [rho, rho_e]:
+            D = np.zeros((self.bins, self.bins))
+            for i in range(self.bins):
+                b = grid[i]
+                s = np.sqrt(np.maximum(grid[i:]**2 - b*b, 0.0))
+                ds = np.diff(s)
+                x = s[:-1,None] + ds[:,None] * w[None,:]
+                integrand = np.interp(np.sqrt(b*b + x*x), r, density)
+                # g/cm^3 * m -> g/cm^2
+                D[i,i+1:] = np.cumsum(np.mean(integrand, axis=1) * ds) * 1e2
+            self.column.append(D)
+            # Near the point of closest approach the mean density tends to the local density
+            self.local_density.append(np.interp(grid * (1.0 - 1e-12), r, density) * 1e2)
+
+    def radial_density(self, r):
+        # Nucleon and electron density along a radius from the earth center
+        # The outermost sample stays just inside the atmosphere
+        r = np.minimum(r, self.atmo_radius * (1.0 - 1e-12))
+        position = vector3.from_components(self.center[0], self.center[1], self.center[2] + r)
+        rho = self.earth.GetDensityInCGS(position)
+        return rho, rho * self.earth.GetPNERatio(position)
+
+    def layer_boundaries(self, r, rho, rho_e, iterations=60):
+        # Radii where the density profile jumps, i.e. where a step is large compared to the neighbouring steps,
+        # located by bisection between the two samples
+        jumps = np.zeros(len(r)-1, dtype=bool)
+        for density in [rho, rho_e]:
+            step = np.abs(np.diff(density))
+            neighbours = np.concatenate([[0.0], step[:-1]]) + np.concatenate([step[1:], [0.0]])
+            jumps |= step > 10.0 * neighbours + 1e-12 * np.max(density)
+        jumps = np.nonzero(jumps)[0]
+        lo = r[jumps]
+        hi = r[jumps+1]
+        rho_lo = rho_e[jumps]
+        rho_hi = rho_e[jumps+1]
+        for i in range(iterations):
+            mid = 0.5 * (lo + hi)
+            rho_mid = self.radial_density(mid)[1]
+            below = np.abs(rho_mid - rho_lo) < np.abs(rho_mid - rho_hi)
+            lo = np.where(below, mid, lo)
+            hi = np.where(below, hi, mid)
+        return 0.5 * (lo + hi)
+
+    def radial_shells(self, boundaries, bins):
+        # Shell radii and the index of the first grid node of every shell, about bins nodes in total
+        shells = np.unique(np.concatenate([[0.0], boundaries, [self.atmo_radius]]))
+        n = np.maximum(64, np.round(bins * np.diff(shells) / self.atmo_radius).astype(int))
+        return shells, np.concatenate([[0], np.cumsum(n)])
+
+    def radial_grid(self):
+        # Nodes on the shell boundaries that are quadratically denser below them
+        index = np.arange(self.shell_start[-1] + 1)
+        return self.index_to_radius(index)
+
+    def shell_of(self, x, edges):
+        return np.clip(np.searchsorted(edges, x, side='right') - 1, 0, len(self.shells) - 2)
+
+    def index_to_radius(self, index):
+        m = self.shell_of(index, self.shell_start)
+        lo, hi = self.shells[m], self.shells[m+1]
+        w = (index - self.shell_start[m]) / (self.shell_start[m+1] - self.shell_start[m]).astype(float)
+        return hi - (hi - lo) * (1.0 - w)**2
+
+    def radius_to_index(self, r):
+        # Fractional grid index of r and its shell
+        m = self.shell_of(r, self.shells)
+        lo, hi = self.shells[m], self.shells[m+1]
+        w = 1.0 - np.sqrt(np.clip((hi - r) / (hi - lo), 0.0, 1.0))
+        return self.shell_start[m] + w * (self.shell_start[m+1] - self.shell_start[m]), m
+
+    @staticmethod
+    def earth_center(earth):
+        # Position of the earth center in detector coordinates
+        if earth.backend == "numpy":
+            return earth.earthModel.GetDetCoordPosFromEarthCoordPos(np.zeros((1, 3)))[0]
+        p = earth.earthModel.GetDetCoordPosFromEarthCoordPos(LeptonInjector.LI_Position(0, 0, 0))
+        return np.array([p.GetX(), p.GetY(), p.GetZ()])
+
+    def half_length(self, b):
+        return np.sqrt(np.maximum(self.atmo_radius**2 - b*b, 0.0))
+
+    def line_coordinates(self, p0, direction):
+        # Impact parameter of the lines and coordinate of p0 along them
+        p0 = np.reshape(p0, (-1, 3)) - self.center[None,:]
+        direction = np.reshape(direction, (-1, 3))
+        direction = direction / np.linalg.norm(direction, axis=1)[:,None]
+        s = np.einsum('ij,ij->i', p0, direction)
+        b = np.linalg.norm(p0 - s[:,None] * direction, axis=1)
+        return b, s
+
+    def column_depth(self, b, s, use_electron_density=False):
+        # Signed column depth from the point of closest approach to s, constant outside the atmosphere
+        L = self.half_length(b)
+        s = np.clip(s, -L, L)
+        r = np.sqrt(b*b + s*s)
+        D = self.column[int(use_electron_density)]
+        rho = self.local_density[int(use_electron_density)]
+        grid = self.grid
+        x, m = self.radius_to_index(b)
+        j = np.clip(np.floor(self.radius_to_index(r)[0]).astype(int), 0, self.bins - 2)
+        # Four rows of the shell around b, Lagrange weights in the index
+        k0 = np.clip(np.floor(x).astype(int) - 1, self.shell_start[m], self.shell_start[m+1] - 3)
+        x = x - k0
+        F = 0.0
+        for n in range(4):
+            w = 1.0
+            for l in range(4):
+                if l != n:
+                    w = w * (x - l) / float(n - l)
+            k = k0 + n
+            b_k = grid[k]
+            s_lo = np.sqrt(np.maximum(grid[j]**2 - b_k**2, 0.0))
+            s_hi = np.sqrt(np.maximum(grid[j+1]**2 - b_k**2, 0.0))
+            s_k = np.sqrt(np.maximum(r*r - b_k**2, 0.0))
+            t = np.clip((s_k - s_lo) / np.where(s_hi > s_lo, s_hi - s_lo, 1.0), 0.0, 1.0)
+            D_k = D[k,j] * (1.0 - t) + D[k,j+1] * t
+            F = F + w * np.where(s_k > 0, D_k / np.where(s_k > 0, s_k, 1.0), rho[k])
+        return s * F
+
+    def total_column_depth(self, b, use_electron_density=False):
+        return 2.0 * self.column_depth(b, self.half_length(b), use_electron_density)
+
+    def GetColumnDepthInCGS(self, p0, p1, use_electron_density=False):
+        p0 = np.reshape(p0, (-1, 3))
+        p1 = np.reshape(p1, (-1, 3))
+        direction = p1 - p0
+        length = np.linalg.norm(direction, axis=1)
+        direction = np.where(length[:,None] > 0, direction, np.array([[0.0, 0.0, 1.0]]))
+        b, s0 = self.line_coordinates(p0, direction)
+        s1 = s0 + length
+        res = self.column_depth(b, s1, use_electron_density) - self.column_depth(b, s0, use_electron_density)
+        return np.where(length > 0, np.maximum(res, 0.0), 0.0)
+
+    def DistanceForColumnDepthToPoint(self, p0, d0, col, use_electron_density=False):
+        # Distance from p0 backwards along d0 that accumulates a column depth of col
+        # Saturates at the atmosphere boundary when there is not enough matter
+        b, s_end = self.line_coordinates(p0, d0)
+        col = np.broadcast_to(np.asarray(col, dtype=float), b.shape)
+        L = self.half_length(b)
+        target = self.column_depth(b, s_end, use_electron_density) - col
+        lo = -L
+        hi = np.clip(s_end, -L, L)
+        for i in range(self.iterations):
+            mid = 0.5 * (lo + hi)
+            below = self.column_depth(b, mid, use_electron_density) < target
+            lo = np.where(below, mid, lo)
+            hi = np.where(below, hi, mid)
+        s = 0.5 * (lo + hi)
+        # Not enough matter along the line, stop at the atmosphere entry
+        s = np.where(target > self.column_depth(b, -L, use_electron_density), s, -L)
+        return np.maximum(s_end - s, 0.0)
+
+    def check(self, n, use_electron_density=False, seed=0):
+        # Maximum relative errors of the forward and inverse queries against the earth model on random chords
+        # through the atmosphere
+        rng = np.random.default_rng(seed)
+        direction = vector3.from_angles(np.arccos(rng.uniform(-1, 1, n)), rng.uniform(0, 2*np.pi, n))
+        b = self.atmo_radius * np.sqrt(rng.uniform(0, 0.99, n))
+        normal = vector3.from_angles(np.arccos(rng.uniform(-1, 1, n)), rng.uniform(0, 2*np.pi, n))
+        normal = (normal - normal.dot(direction) * direction).normalized()
+        L = self.half_length(b)
+        pca = normal * b + self.center
+        p0 = pca + direction * (L * rng.uniform(-1, 1, n))
+        p1 = pca + direction * (L * rng.uniform(-1, 1, n))
+        exact = self.earth.model_column_depth(p0, p1, use_electron_density)
+        approx = self.GetColumnDepthInCGS(p0.xyz, p1.xyz, use_electron_density)
+        scale = self.total_column_depth(b, use_electron_density)
+        forward = np.max(np.abs(approx - exact) / scale)
+        d = (p1 - p0).normalized()
+        col = self.earth.model_column_depth(p1 - d * (p1 - p0).magnitude() * rng.uniform(0, 1, n), p1, use_electron_density)
+        distance = self.DistanceForColumnDepthToPoint(p1.xyz, d.xyz, col, use_electron_density)
+        back = self.earth.model_column_depth(p1 - d * distance, p1, use_electron_density)
+        inverse = np.max(np.abs(back - col) / scale)
+        return forward, inverse
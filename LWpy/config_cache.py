@@ -0,0 +1,139 @@
+import os
+import sys
+import pickle
+import hashlib
+from .lic import read_stream
+from .generator import generator
+from .generator import volume_generator
+from .generator import ranged_generator
+from .numpy_earth import numpy_earth
+from .vector import vector3
+from .spline_store import spline_store, atomic_write
+import EarthModelService
+
+class config_cache:
+    # Persistent cache of parsed .lic files and earth models for fast startup
+    # Parsed blocks and their per block constants are keyed by the content hash of the .lic file,
+    # which is itself cached by the path, size and modification time of the file so a warm start reads no file contents
+    # numpy earth models by the earth parameters and the contents of their density and material files
+    # EarthModelService objects cannot be serialized and are only shared within the process
+    # Entries are also keyed by the sources of the pickled classes, so entries written by other code are not read
+    version = 1
+    pickled_classes = [read_stream, generator, volume_generator, ranged_generator, numpy_earth, vector3]
+    schema = None
+
+    @staticmethod
+    def code_version():
+        if config_cache.schema is None:
+            h = hashlib.sha512(str(config_cache.version).encode('ascii'))
+            for cls in config_cache.pickled_classes:
+                fname = sys.modules[cls.__module__].__file__
+                f = open(fname, 'rb')
+                try:
+                    h.update(f.read())
+                finally:
+                    f.close()
+            config_cache.schema = h.hexdigest()[:16]
+        return config_cache.schema
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get("LWPY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "LWpy"))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.earth_models = dict()
+
+    def path(self, kind, key):
+        return os.path.join(self.cache_dir, kind + '_' + config_cache.code_version() + '_' + key + '.pkl')
+
+    def load(self, path):
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            entry = pickle.load(f)
+        except Exception:
+            # Truncated files or classes that moved or changed since the entry was written
+            entry = None
+        finally:
+            f.close()
+        if entry is None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != config_cache.version:
+            return None
+        return entry
+
+    def save(self, path, entry):
+        entry = dict(entry, version=config_cache.version)
+        atomic_write(path, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def file_hash(self, fname):
+        # Content hash of fname, only recomputed when its path, size or modification time change
+        st = os.stat(fname)
+        key = hashlib.sha512(repr((os.path.abspath(fname), st.st_size, st.st_mtime_ns, st.st_ino)).encode('utf-8')).hexdigest()
+        path = self.path("stat", key)
+        entry = self.load(path)
+        if entry is None:
+            entry = {"hash": spline_store.file_hash(fname)}
+            self.save(path, entry)
+        return entry["hash"]
+
+    def read(self, fname, spline_dir='./'):
+        # Blocks of fname and a list of per block constants (None for EnumDef blocks)
+        path = self.path("lic", self.file_hash(fname))
+        entry = self.load(path)
+        if entry is not None:
+            names = [d[k] for s, v, d in entry["blocks"] if s != "EnumDef" for k in ["totalCrossSection", "differentialCrossSection"]]
+            # The splines are only extracted when the file is parsed
+            if all(os.path.isfile(os.path.join(spline_dir, n)) for n in names):
+                return entry["blocks"], entry["constants"]
+        with read_stream(fname, spline_dir=spline_dir) as s:
+            blocks = s.read()
+        constants = [None if s == "EnumDef" else generator.block_constants(s, d) for s, v, d in blocks]
+        self.save(path, {"blocks": blocks, "constants": constants})
+        return blocks, constants
+
+    def earth_key(self, earth_model_params, backend):
+        h = hashlib.sha512(repr((backend, list(earth_model_params))).encode('utf-8'))
+        name, tablepath, earthmodels, materialmodels = earth_model_params[:4]
+        files = [os.path.join(tablepath, 'densities', m + '.dat') for m in earthmodels]
+        files += [os.path.join(tablepath, 'materials', m + '.dat') for m in materialmodels]
+        for fname in files:
+            if os.path.isfile(fname):
+                h.update(self.file_hash(fname).encode('ascii'))
+        return h.hexdigest()
+
+    def earth_model(self, earth_model_params, backend="numpy"):
+        key = self.earth_key(earth_model_params, backend)
+        if key in self.earth_models:
+            return self.earth_models[key]
+        if backend == "numpy":
+            path = self.path("earth", key)
+            entry = self.load(path)
+            if entry is None:
+                entry = {"earth_model": numpy_earth(*earth_model_params)}
+                self.save(path, entry)
+            model = entry["earth_model"]
+        else:
+            model = EarthModelService.EarthModelService(*earth_model_params)
+        self.earth_models[key] = model
+        return model
+
+    def generators(self, fname, earth_model_params=None, spline_dir='./', earth_backend="numpy"):
+        # Generators for the blocks of fname built from the cached blocks, constants and earth model
+        blocks, constants = self.read(fname, spline_dir)
+        gens = []
+        for block, c in zip(blocks, constants):
+            block_name, block_version, block_data = block
+            if block_name == "VolumeInjectionConfiguration":
+                gens.append(volume_generator(block, spline_dir=spline_dir, constants=c))
+            elif block_name == "RangedInjectionConfiguration":
+                earth_model = self.earth_model(earth_model_params, earth_backend)
+                gens.append(ranged_generator(block, earth_model_params, spline_dir=spline_dir, earth_backend=earth_backend, earth_model=earth_model, constants=c))
+        return gens
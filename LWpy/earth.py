@@ -1,40 +1,145 @@
 from .generator import generator
 import numpy as np
+import warnings
 import functools
 import EarthModelService
 import LeptonInjector
+from .numpy_earth import numpy_earth
+from .vector import vector3
+from .column_depth_table import column_depth_table
+
+class lepton_range_table:
+    # EarthModelCalculator.GetLeptonRange tabulated in log10(energy) and interpolated linearly in log10(range)
+    # Intervals whose relative error at the midpoint exceeds tolerance are split until it is met,
+    # intervals that still fail after max_bins intervals or min_width are evaluated directly
+    # Energies outside [energy_min, energy_max] are evaluated directly
+    def __init__(self, isTau, option, scale, tolerance=1e-6, energy_min=1e-1, energy_max=1e12, bins=1024, max_bins=1<<16, min_width=1e-9):
+        self.isTau = isTau
+        self.option = option
+        self.scale = scale
+        self.tolerance = tolerance
+        self.energy_min = energy_min
+        self.energy_max = energy_max
+        log_e = np.linspace(np.log10(energy_min), np.log10(energy_max), bins+1)
+        log_r = np.log10(self.direct(10**log_e, isTau, option, scale))
+        log_mid = np.log10(self.direct(10**((log_e[1:] + log_e[:-1]) / 2.), isTau, option, scale))
+        while True:
+            error = np.abs(10**((log_r[1:] + log_r[:-1]) / 2. - log_mid) - 1.0)
+            bad = np.logical_and(error > tolerance, log_e[1:] - log_e[:-1] > min_width)
+            n_bad = int(np.count_nonzero(bad))
+            if n_bad == 0 or len(log_mid) + n_bad > max_bins:
+                break
+            # Split the failing intervals at their midpoints, the midpoints of the new halves are evaluated
+            mid = (log_e[1:] + log_e[:-1]) / 2.
+            lower = (log_e[:-1][bad] + mid[bad]) / 2.
+            upper = (mid[bad] + log_e[1:][bad]) / 2.
+            half_mid = np.log10(self.direct(10**np.concatenate([lower, upper]), isTau, option, scale))
+            start = np.concatenate([[0], np.cumsum(np.where(bad, 2, 1))[:-1]])
+            new_mid = np.empty(len(log_mid) + n_bad)
+            new_mid[start[~bad]] = log_mid[~bad]
+            new_mid[start[bad]] = half_mid[:n_bad]
+            new_mid[start[bad]+1] = half_mid[n_bad:]
+            node = np.insert(np.arange(len(log_e)), np.flatnonzero(bad) + 1, -1)
+            new_e = np.empty(len(node))
+            new_r = np.empty(len(node))
+            new_e[node >= 0] = log_e
+            new_r[node >= 0] = log_r
+            new_e[node < 0] = mid[bad]
+            new_r[node < 0] = log_mid[bad]
+            log_e, log_r, log_mid = new_e, new_r, new_mid
+        self.log_e = log_e
+        self.log_r = log_r
+        # Intervals left above tolerance are evaluated directly
+        self.direct_intervals = error > tolerance
+        self.max_error = float(np.max(error[~self.direct_intervals])) if np.any(~self.direct_intervals) else 0.0
+        if np.any(self.direct_intervals):
+            warnings.warn("Lepton range table does not reach tolerance " + str(tolerance) + " in "
+                    + str(int(np.count_nonzero(self.direct_intervals))) + " intervals, they are evaluated directly")
+
+    @staticmethod
+    def direct(energy, isTau, option, scale):
+        return np.array([EarthModelService.EarthModelCalculator.GetLeptonRange(e, isTau, option, scale) for e in np.asarray(energy, dtype=float).reshape(-1)])
+
+    def __call__(self, energy):
+        energy = np.asarray(energy, dtype=float).reshape(-1)
+        inside = np.logical_and(energy >= self.energy_min, energy <= self.energy_max)
+        if np.any(self.direct_intervals):
+            interval = np.clip(np.searchsorted(self.log_e, np.log10(energy[inside]), side='right') - 1, 0, len(self.direct_intervals) - 1)
+            inside[inside] = ~self.direct_intervals[interval]
+        if np.all(inside):
+            return 10**np.interp(np.log10(energy), self.log_e, self.log_r)
+        res = np.empty(len(energy))
+        res[inside] = 10**np.interp(np.log10(energy[inside]), self.log_e, self.log_r)
+        res[~inside] = self.direct(energy[~inside], self.isTau, self.option, self.scale)
+        return res
 
 class earth:
-    def __init__(self, earth_model_params=None):
-        self.earthModel = EarthModelService.EarthModelService(*earth_model_params)
+    backends = ["EarthModelService", "numpy"]
+    lepton_range_tables = dict()
+    mwe_to_cgs = None
+    cgs_to_mwe = None
+
+    def __init__(self, earth_model_params=None, backend="EarthModelService", earth_model=None):
+        if backend not in earth.backends:
+            raise ValueError("Unknown earth backend " + str(backend) + ", options are " + str(earth.backends))
+        self.backend = backend
+        self.column_depth_table = None
+        if earth_model is not None:
+            # Share an already constructed model between objects
+            self.earthModel = earth_model
+        elif backend == "numpy":
+            self.earthModel = numpy_earth(*earth_model_params)
+        else:
+            self.earthModel = EarthModelService.EarthModelService(*earth_model_params)
+
+    def tabulate_column_depth(self, table=None, **kwargs):
+        # Answer GetColumnDepthInCGS and DistanceForColumnDepthToPoint from a column_depth_table
+        # Pass a table to share it between objects using the same earth model, None builds one from kwargs
+        if table is None:
+            table = column_depth_table(self, **kwargs)
+        self.column_depth_table = table
+        return table
 
     @staticmethod
-    @np.vectorize
     def get_pca(direction, position, origin=(0,0,0)):
-        origin = LeptonInjector.LI_Position(*origin)
-        return (direction*(origin - position)) * direction + position
+        return vector3.pca(direction, position, origin)
 
     @staticmethod
     def GetLeptonRange(energy,
             isTau=False,
             option=EarthModelService.EarthModelCalculator.LeptonRangeOption.DEFAULT,
-            scale=1.):
-        return np.array([EarthModelService.EarthModelCalculator.GetLeptonRange(e, isTau, option, scale) for e in energy])
+            scale=1.,
+            tolerance=1e-6):
+        # Tabulated once per (isTau, option, scale, tolerance), tolerance=None calls EarthModelCalculator for every energy
+        if tolerance is None:
+            return lepton_range_table.direct(energy, isTau, option, scale)
+        key = (isTau, option, scale, tolerance)
+        if key not in earth.lepton_range_tables:
+            earth.lepton_range_tables[key] = lepton_range_table(isTau, option, scale, tolerance=tolerance)
+        return earth.lepton_range_tables[key](energy)
 
     @staticmethod
-    @np.vectorize
     def MWEtoColumnDepthCGS(range_MWE):
-        return EarthModelService.EarthModelCalculator.MWEtoColumnDepthCGS(range_MWE)
+        # The conversion is linear, the factor is taken from EarthModelCalculator once
+        if earth.mwe_to_cgs is None:
+            earth.mwe_to_cgs = EarthModelService.EarthModelCalculator.MWEtoColumnDepthCGS(1.0)
+        return np.asarray(range_MWE, dtype=float) * earth.mwe_to_cgs
 
     @staticmethod
-    @np.vectorize
     def ColumnDepthCGStoMWE(cdep_CGS):
-        return EarthModelService.EarthModelCalculator.ColumnDepthCGStoMWE(cdep_CGS)
+        if earth.cgs_to_mwe is None:
+            earth.cgs_to_mwe = EarthModelService.EarthModelCalculator.ColumnDepthCGStoMWE(1.0)
+        return np.asarray(cdep_CGS, dtype=float) * earth.cgs_to_mwe
 
     def GetAtmoPoints(self, pca, direction):
+        pca = vector3.as_vector3(pca)
+        direction = vector3.as_vector3(direction)
+        if self.backend == "numpy":
+            a_entry, a_exit = self.earthModel.GetAtmoPoints(pca.xyz, direction.xyz)
+            return vector3(a_entry), vector3(a_exit)
         a_entry = []
         a_exit = []
-        for pca, direction in zip(pca, direction):
+        for pca, direction in zip(pca.to_li_positions(), direction.to_li_directions()):
             atmoEntry = None
             atmoExit = None
             atmoEntry = LeptonInjector.LI_Position()
@@ -48,33 +153,74 @@ class earth:
             atmoExit = self.earthModel.GetDetCoordPosFromEarthCoordPos(atmoExit)
             a_entry.append(atmoEntry)
             a_exit.append(atmoExit)
-        return np.array(a_entry), np.array(a_exit)
+        return vector3.from_li(a_entry), vector3.from_li(a_exit)
 
     def GetColumnDepthInCGS(self, p0, p1, use_electron_density=False):
+        p0 = vector3.as_vector3(p0)
+        p1 = vector3.as_vector3(p1)
+        if self.column_depth_table is not None:
+            return self.column_depth_table.GetColumnDepthInCGS(p0.xyz, p1.xyz, use_electron_density)
+        return self.model_column_depth(p0, p1, use_electron_density)
+
+    def model_column_depth(self, p0, p1, use_electron_density=False):
+        # Column depth from the earth model, also when a column_depth_table is installed
+        p0 = vector3.as_vector3(p0)
+        p1 = vector3.as_vector3(p1)
+        if self.backend == "numpy":
+            return self.earthModel.GetColumnDepthInCGS(p0.xyz, p1.xyz, use_electron_density)
         return np.array([self.earthModel.GetColumnDepthInCGS(
             pp0,
             pp1,
             use_electron_density)
-            for pp0,pp1 in zip(p0, p1)])
+            for pp0,pp1 in zip(p0.to_li_positions(), p1.to_li_positions())])
 
 
     def DistanceForColumnDepthToPoint(self, p0, d0, col, use_electron_density=False):
+        p0 = vector3.as_vector3(p0)
+        d0 = vector3.as_vector3(d0)
+        if self.column_depth_table is not None:
+            return self.column_depth_table.DistanceForColumnDepthToPoint(p0.xyz, d0.xyz, col, use_electron_density)
+        if self.backend == "numpy":
+            return self.earthModel.DistanceForColumnDepthToPoint(p0.xyz, d0.xyz, col, use_electron_density)
         return np.array([self.earthModel.DistanceForColumnDepthToPoint(
             p,
             d,
             c,
             use_electron_density)
-            for p,d,c in zip(p0, d0, col)])
+            for p,d,c in zip(p0.to_li_positions(), d0.to_li_directions(), col)])
+
     def GetDensitySegments(self, first_point, last_point):
-        return [self.earthModel.GetDensitySegments(fp, lp) for fp,lp in zip(first_point, last_point)]
+        first_point = vector3.as_vector3(first_point)
+        last_point = vector3.as_vector3(last_point)
+        if self.backend == "numpy":
+            return self.earthModel.GetDensitySegments(first_point.xyz, last_point.xyz)
+        return [self.earthModel.GetDensitySegments(fp, lp) for fp,lp in zip(first_point.to_li_positions(), last_point.to_li_positions())]
+
+    def GetDensitySegmentArrays(self, first_point, last_point):
+        # Flattened density segments with offsets[i]:offsets[i+1] belonging to path i
+        if self.backend == "numpy":
+            first_point = vector3.as_vector3(first_point)
+            last_point = vector3.as_vector3(last_point)
+            return self.earthModel.GetDensitySegmentArrays(first_point.xyz, last_point.xyz)
+        segments = self.GetDensitySegments(first_point, last_point)
+        offsets = np.zeros(len(segments)+1, dtype=int)
+        np.cumsum([len(s) for s in segments], out=offsets[1:])
+        segments = np.array([seg for s in segments for seg in s], dtype=float).reshape((-1, 3))
+        return offsets, segments[:,0], segments[:,1], segments[:,2]
 
     def GetDensityInCGS(self, position):
-        return np.array([self.earthModel.GetDensityInCGS(p) for p in position])
+        position = vector3.as_vector3(position)
+        if self.backend == "numpy":
+            return self.earthModel.GetDensityInCGS(position.xyz)
+        return np.array([self.earthModel.GetDensityInCGS(p) for p in position.to_li_positions()])
 
     def GetPNERatio(self, position):
+        position = vector3.as_vector3(position)
+        if self.backend == "numpy":
+            return self.earthModel.GetPNERatio(position.xyz)
         proton = int(LeptonInjector.Particle.ParticleType.PPlus)
         offsets = []
-        for p in position:
+        for p in position.to_li_positions():
             current_medium = self.earthModel.GetEarthParam(self.earthModel.GetEarthCoordPosFromDetCoordPos(p))
             offsets.append(self.earthModel.GetPNERatio(current_medium.fMediumType_, proton))
         return np.array(offsets)
@@ -0,0 +1,116 @@
+import numpy as np
+from .vector import vector3
+
+def final_state(batch):
+    # Final state particle types sorted per event, shape (final state size, n)
+    names = [n for n in batch.names if "final_type" in n]
+    return np.sort(np.array([batch[n] for n in names]).astype(int), axis=0)
+
+def signature(batch):
+    # (particle, sorted final state) per event, shape (n, 3)
+    return np.concatenate([batch["particle"].astype(int)[None,:], batch["final_state"]]).T
+
+class event_batch:
+    # Rows of a structured event array or of a dict of equally long columns, accessed column by column
+    # A column is gathered for the rows of the batch when it is first read and kept for reuse
+    # Derived columns are computed from the stored ones on first use and kept as well
+    # Indexing with a mask, an index array or a slice gives the batch of the selected rows, which gathers its
+    # columns from the columns already read or derived here, so no full records are ever copied
+    derived = {
+            "log10_energy": lambda b: np.log10(b["energy"]),
+            "log10_bjorken_x": lambda b: np.log10(b["bjorken_x"]),
+            "log10_bjorken_y": lambda b: np.log10(b["bjorken_y"]),
+            "direction": lambda b: vector3.from_angles(b["zenith"], b["azimuth"]),
+            "position": lambda b: vector3.from_components(b["x"], b["y"], b["z"]),
+            "final_state": final_state,
+            "signature": signature,
+            }
+
+    def __init__(self, events, index=None):
+        if isinstance(events, event_batch):
+            if index is not None:
+                events = events.take(index)
+            # Same rows, the columns read so far are shared
+            self.events = events.events
+            self.index = events.index
+            self.parent = events.parent
+            self.selection = events.selection
+            self.columns = events.columns
+        else:
+            if isinstance(events, dict):
+                events = dict((k, np.asarray(v)) for k, v in events.items())
+            else:
+                events = np.asarray(events)
+            self.events = events
+            self.index = None if index is None else event_batch.as_index(index, event_batch.source_length(events))
+            self.parent = None
+            self.selection = None
+            self.columns = dict()
+
+    @staticmethod
+    def source_length(events):
+        if isinstance(events, dict):
+            return len(next(iter(events.values()))) if len(events) > 0 else 0
+        return len(events)
+
+    @staticmethod
+    def as_index(selection, n):
+        if isinstance(selection, slice):
+            return np.arange(n)[selection]
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return np.flatnonzero(selection)
+        return selection.astype(int, copy=False).reshape(-1)
+
+    def __len__(self):
+        return event_batch.source_length(self.events) if self.index is None else len(self.index)
+
+    @property
+    def names(self):
+        # Names of the stored columns
+        if isinstance(self.events, dict):
+            return tuple(self.events.keys())
+        return self.events.dtype.names
+
+    def __contains__(self, name):
+        return name in self.names or name in event_batch.derived
+
+    def column(self, name):
+        if name not in self.columns:
+            if self.parent is not None and name in self.parent.columns:
+                self.columns[name] = self.parent.columns[name][self.selection]
+            elif name not in self.names and name in event_batch.derived:
+                self.columns[name] = event_batch.derived[name](self)
+            elif self.index is None:
+                self.columns[name] = self.events[name]
+            else:
+                self.columns[name] = self.events[name][self.index]
+        return self.columns[name]
+
+    def take(self, selection):
+        selection = event_batch.as_index(selection, len(self))
+        batch = event_batch(self.events, selection if self.index is None else self.index[selection])
+        batch.parent = self
+        batch.selection = selection
+        return batch
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.column(key)
+        return self.take(key)
+
+    def records(self):
+        # Structured array of the rows, for code that needs full records
+        if isinstance(self.events, dict):
+            names = self.names
+            res = np.empty(len(self), dtype=[(n, np.asarray(self.events[n]).dtype) for n in names])
+            for n in names:
+                res[n] = self.column(n)
+            return res
+        return self.events if self.index is None else self.events[self.index]
+
+def as_events(events):
+    # Event batches are used as they are, structured arrays and dicts of columns are wrapped
+    if isinstance(events, event_batch):
+        return events
+    return event_batch(events)
@@ -0,0 +1,99 @@
+import numpy as np
+
+def hdf5():
+    # h5py is only needed for event files, so it is imported on first use
+    import h5py
+    return h5py
+
+# Field names of the LeptonInjector "properties" dataset, in file order
+property_names = (
+        'energy',
+        'zenith',
+        'azimuth',
+        'bjorken_x',
+        'bjorken_y',
+        'final_type_0',
+        'final_type_1',
+        'particle',
+        'radius',
+        'z',
+        'total_column_depth',
+        )
+
+class event_file:
+    # Chunked access to the injector groups of a LeptonInjector HDF5 file
+    # Each chunk of the properties dataset is read into a reused buffer and copied field by field into
+    # a structured array with the renamed fields plus the zero filled extra fields,
+    # so memory stays bounded by chunk_size whatever the size of the file
+    def __init__(self, filename, chunk_size=1<<16, names=property_names, extra_fields=(('x', '<f8'), ('y', '<f8')), dataset="properties", mode="r"):
+        if chunk_size < 1:
+            raise ValueError("Need a positive chunk size, got " + str(chunk_size))
+        self.filename = filename
+        self.chunk_size = int(chunk_size)
+        self.names = tuple(names)
+        self.extra_fields = [(n, np.dtype(f)) for n, f in extra_fields]
+        self.dataset = dataset
+        self.file = hdf5().File(filename, mode)
+
+    def groups(self):
+        return [k for k in self.file.keys() if isinstance(self.file[k], hdf5().Group) and self.dataset in self.file[k]]
+
+    def __len__(self):
+        return sum(self.file[g][self.dataset].shape[0] for g in self.groups())
+
+    def event_dtype(self, source_dtype):
+        if len(source_dtype.names) != len(self.names):
+            raise ValueError("Expected " + str(len(self.names)) + " fields in the " + self.dataset + " dataset, found " + str(len(source_dtype.names)))
+        fields = [(n, source_dtype.fields[s][0]) for n, s in zip(self.names, source_dtype.names)]
+        fields += self.extra_fields
+        return np.dtype(fields)
+
+    def chunks(self, group):
+        # Yields (start, events) for consecutive chunks of the group
+        # The yielded array is overwritten by the next chunk, copy it to keep it
+        dset = self.file[group][self.dataset]
+        n = dset.shape[0]
+        size = min(self.chunk_size, n)
+        buf = np.empty(size, dtype=dset.dtype)
+        events = np.zeros(size, dtype=self.event_dtype(dset.dtype))
+        for start in range(0, n, self.chunk_size):
+            stop = min(start + self.chunk_size, n)
+            m = stop - start
+            dset.read_direct(buf, source_sel=np.s_[start:stop], dest_sel=np.s_[0:m])
+            for s, name in zip(dset.dtype.names, self.names):
+                events[name][:m] = buf[s][:m]
+            yield start, events[:m]
+
+    def __iter__(self):
+        for group in self.groups():
+            for start, events in self.chunks(group):
+                yield group, start, events
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def weight_file(filename, func, output=None, output_dataset="weights", chunk_size=1<<16, **kwargs):
+    # Evaluate func(events) (e.g. weighter.weight or a parallel method) chunk by chunk and write the
+    # result to output_dataset in every injector group of output
+    # Without an output file the results are written back to the input file
+    mode = "r" if output is not None else "r+"
+    with event_file(filename, chunk_size=chunk_size, mode=mode, **kwargs) as f:
+        out = f.file if output is None else hdf5().File(output, "a")
+        try:
+            for group in f.groups():
+                n = f.file[group][f.dataset].shape[0]
+                out_group = out.require_group(group)
+                if output_dataset in out_group:
+                    del out_group[output_dataset]
+                dset = out_group.create_dataset(output_dataset, shape=(n,), dtype='f8', chunks=(max(1, min(f.chunk_size, n)),))
+                for start, events in f.chunks(group):
+                    dset[start:start+len(events)] = func(events)
+        finally:
+            if output is not None:
+                out.close()
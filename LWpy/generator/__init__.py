@@ -1,3 +1,4 @@
 from .generator import generator
 from .ranged_generator import ranged_generator
 from .volume_generator import volume_generator
+from .volume_generator import geometry_error
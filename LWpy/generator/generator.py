@@ -1,43 +1,70 @@
 from ..spline import spline_repo, eval_spline
+from ..lic import spline_blob
+from ..instrument import stage, instrumented
+from ..event_batch import event_batch, as_events
 import os.path
 import numpy as np
 import photospline
 
 class generator:
-    def __init__(self, block, spline_dir='./'):
+    def __init__(self, block, spline_dir='./', constants=None):
         block_name, block_version, block_data = block
         self.block_type = block_name
         self.block_version = block_version
         self.block = block_data
         self.total_xs = self.block["totalCrossSection"]
         self.differential_xs = self.block["differentialCrossSection"]
+        # Splines from an index only read_stream are written to spline_dir on first use
+        if isinstance(self.total_xs, spline_blob):
+            self.total_xs = self.total_xs.materialize(spline_dir)
+        if isinstance(self.differential_xs, spline_blob):
+            self.differential_xs = self.differential_xs.materialize(spline_dir)
         self.Na = 6.022140857e+23
         self.earth_model = None
         self.spline_dir = spline_dir
+        if constants is None:
+            constants = generator.block_constants(block_name, block_data)
+        self.constants = constants
+
+    @staticmethod
+    def block_constants(block_type, block):
+        # Normalizations that only depend on the block
+        index = block["powerlaw_index"]
+        energy_min = block["energy_min"]
+        energy_max = block["energy_max"]
+        if index != 1:
+            energy_norm = (1.0-index) / (energy_max**(1.0-index) - energy_min**(1.0-index))
+        else:
+            energy_norm = 1.0 / np.log(energy_max/energy_min)
+        solid_angle = (block["azimuth_max"]-block["azimuth_min"])*(np.cos(block["zenith_min"])-np.cos(block["zenith_max"]))
+        radius = block["radius"]
+        constants = {
+                "energy_norm": energy_norm,
+                "solid_angle": solid_angle,
+                "area": np.pi * radius * radius,
+                }
+        if "height" in block:
+            constants["volume"] = np.pi * radius * radius * block["height"]
+        return constants
 
     def prob_stat(self, event):
         return self.block["events"]
 
     def prob_e(self, events):
-        norm = 0
         index = self.block["powerlaw_index"]
         energy_min = self.block["energy_min"]
         energy_max = self.block["energy_max"]
 
-        events = np.asarray(events)
+        events = as_events(events)
         res = np.zeros(len(events))
         energy = events["energy"]
         nonzero = np.logical_and(energy >= energy_min, energy <= energy_max)
 
-        if index != 1:
-            norm = (1.0-index) / (energy_max**(1.0-index) - energy_min**(1.0-index))
-        elif index == 1:
-            norm = 1.0 / np.log(energy_max/energy_min)
-        res[nonzero] = norm * energy[nonzero] ** (-index)
+        res[nonzero] = self.constants["energy_norm"] * energy[nonzero] ** (-index)
         return res
 
     def prob_dir(self, events):
-        events = np.asarray(events)
+        events = as_events(events)
         res = np.zeros(len(events))
         zenith_min = self.block["zenith_min"]
         zenith_max = self.block["zenith_max"]
@@ -52,11 +79,11 @@ class generator:
                 azimuth >= azimuth_min,
                 azimuth <= azimuth_max,
                 ], axis=0)
-        res[nonzero] = 1.0/((azimuth_max-azimuth_min)*(np.cos(zenith_min)-np.cos(zenith_max)))
+        res[nonzero] = 1.0/self.constants["solid_angle"]
         return res
 
     def prob_final_state(self, events):
-        events = np.asarray(events)
+        events = as_events(events)
         final_type_0 = events["final_type_0"]
         final_type_1 = events["final_type_1"]
         return np.logical_or(
@@ -66,39 +93,59 @@ class generator:
                            final_type_1 == self.block["final_type_0"])
             ).astype(float)
 
-    def prob_area(self, events):
+    def contains(self, events):
+        return np.ones(len(events), dtype=bool)
+
+    def prob_ranges(self, events):
+        # Considered ranges shared by prob_area and prob_pos in prob
+        return None, None
+
+    def prob_area(self, events, first_pos=None, last_pos=None):
         raise
         return 1.0
 
-    def prob_pos(self, events):
+    def prob_pos(self, events, first_pos=None, last_pos=None):
         raise
         return 1.0
 
     def prob_kinematics(self, events):
-        events = np.asarray(events)
-        energy = events["energy"]
-        x = events["bjorken_x"]
-        y = events["bjorken_y"]
-        coords = np.array([np.log10(energy), np.log10(x), np.log10(y)])
+        events = as_events(events)
+        coords = np.array([events["log10_energy"], events["log10_bjorken_x"], events["log10_bjorken_y"]])
         diff_xs = 10.0**eval_spline(spline_repo[os.path.join(self.spline_dir, self.differential_xs)], coords)
         total_xs = 10.0**eval_spline(spline_repo[os.path.join(self.spline_dir, self.total_xs)], coords[:1])
         return diff_xs / total_xs
 
     def number_of_targets(self, events):
-        events = np.asarray(events)
+        events = as_events(events)
         return self.Na * events["total_column_depth"]
 
+    @staticmethod
+    def compact(p, index, events):
+        # Indices of the events with a nonzero probability so far, and their batch
+        keep = np.flatnonzero(p[index])
+        if len(keep) == len(index):
+            return index, events
+        return index[keep], events[keep]
+
+    @instrumented
     def prob(self, events):
-        p = self.prob_final_state(events)
-        p *= self.prob_stat(events)
-        nonzero = p != 0
-        p[nonzero] *= self.prob_dir(events[nonzero])
-        nonzero = p != 0
-        p[nonzero] *= self.prob_e(events[nonzero])
-        nonzero = p != 0
-        p[nonzero] *= self.prob_area(events[nonzero])
-        nonzero = p != 0
-        p[nonzero] *= self.prob_pos(events[nonzero])
-        nonzero = p != 0
-        p[nonzero] *= self.prob_kinematics(events[nonzero])
+        # Each stage only sees the events that survived the previous ones
+        # The survivors are tracked as an index array and an event_batch, which gathers just the
+        # columns a stage reads for the surviving rows
+        # Every stage is reported to the instrument callbacks as <class name>.<stage>
+        name = type(self).__name__ + "."
+        events = event_batch(events)
+        p = stage(name + "prob_final_state", self.prob_final_state, events)
+        p *= stage(name + "prob_stat", self.prob_stat, events)
+        index = np.flatnonzero(p)
+        events = events[index]
+        p[index] *= stage(name + "prob_dir", self.prob_dir, events)
+        index, events = generator.compact(p, index, events)
+        p[index] *= stage(name + "prob_e", self.prob_e, events)
+        index, events = generator.compact(p, index, events)
+        first_pos, last_pos = stage(name + "prob_ranges", self.prob_ranges, events)
+        p[index] *= stage(name + "prob_area", self.prob_area, events, first_pos, last_pos)
+        p[index] *= stage(name + "prob_pos", self.prob_pos, events, first_pos, last_pos)
+        index, events = generator.compact(p, index, events)
+        p[index] *= stage(name + "prob_kinematics", self.prob_kinematics, events)
         return p
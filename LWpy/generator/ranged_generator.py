@@ -1,40 +1,46 @@
 from .generator import generator
 from ..earth import earth
+from ..event_batch import as_events
 import numpy as np
-import functools
-import EarthModelService
 import LeptonInjector
 
 class ranged_generator(generator, earth):
-    def __init__(self, block, earth_model_params=None, spline_dir='./'):
-        generator.__init__(self, block, spline_dir=spline_dir)
-        earth.__init__(self, earth_model_params)
-
-    def prob_area(self, events):
-        events = np.asarray(events)
-        radius = self.block["radius"]
-        p_area = 1.0 / (np.pi * radius * radius)
-        p_area /= 1e4 # Convert from m^-2 to cm^-2
-        return p_area
+    def __init__(self, block, earth_model_params=None, spline_dir='./', earth_backend="EarthModelService", earth_model=None, constants=None):
+        generator.__init__(self, block, spline_dir=spline_dir, constants=constants)
+        earth.__init__(self, earth_model_params, backend=earth_backend, earth_model=earth_model)
 
-    def get_considered_range(self, events):
-        energy = events["energy"]
-        zenith = events["zenith"]
-        azimuth = events["azimuth"]
-        x = events["x"]
-        y = events["y"]
-        z = events["z"]
-        isTau = ((self.block["final_type_0"] == LeptonInjector.Particle.ParticleType.TauMinus
+    def is_tau(self):
+        return ((self.block["final_type_0"] == LeptonInjector.Particle.ParticleType.TauMinus
             or self.block["final_type_0"] == LeptonInjector.Particle.ParticleType.TauPlus)
             or (self.block["final_type_1"] == LeptonInjector.Particle.ParticleType.TauMinus
                 or self.block["final_type_1"] == LeptonInjector.Particle.ParticleType.TauPlus))
 
-        use_electron_density = LeptonInjector.getInteraction(
+    def use_electron_density(self):
+        return LeptonInjector.getInteraction(
                     LeptonInjector.Particle.ParticleType(self.block["final_type_0"]),
                     LeptonInjector.Particle.ParticleType(self.block["final_type_1"])) == 2
 
-        position = np.array([LeptonInjector.LI_Position(xx, yy, zz) for xx,yy,zz in zip(x,y,z)])
-        direction = np.array([LeptonInjector.LI_Direction(zen, azi) for zen,azi in zip(zenith, azimuth)])
+    def geometry_key(self):
+        # Blocks with the same key share the same considered range for every event
+        return (self.block_type, self.block["radius"], self.block["length"], self.is_tau(), self.use_electron_density())
+
+    def prob_ranges(self, events):
+        return self.get_considered_range(events)
+
+    def prob_area(self, events, first_pos=None, last_pos=None):
+        events = as_events(events)
+        p_area = 1.0 / self.constants["area"]
+        p_area /= 1e4 # Convert from m^-2 to cm^-2
+        return p_area
+
+    def get_considered_range(self, events):
+        events = as_events(events)
+        energy = events["energy"]
+        isTau = self.is_tau()
+        use_electron_density = self.use_electron_density()
+
+        position = events["position"]
+        direction = events["direction"]
         endcapLength = self.block["length"] * LeptonInjector.Constants.meter
 
         pca = self.get_pca(direction, position)
@@ -67,20 +73,15 @@ class ranged_generator(generator, earth):
 
         return first_point, last_point
 
-    def prob_pos(self, events):
-        events = np.asarray(events)
+    def prob_pos(self, events, first_pos=None, last_pos=None):
+        events = as_events(events)
 
-        x = events["x"]
-        y = events["y"]
-        z = events["z"]
-
-        use_electron_density = LeptonInjector.getInteraction(
-                    LeptonInjector.Particle.ParticleType(self.block["final_type_0"]),
-                    LeptonInjector.Particle.ParticleType(self.block["final_type_1"])) == 2
+        use_electron_density = self.use_electron_density()
 
-        first_pos, last_pos = self.get_considered_range(events)
+        if first_pos is None or last_pos is None:
+            first_pos, last_pos = self.get_considered_range(events)
 
-        position = np.array([LeptonInjector.LI_Position(xx, yy, zz) for xx,yy,zz in zip(x,y,z)])
+        position = events["position"]
 
         totalColumnDepth = self.GetColumnDepthInCGS(last_pos, first_pos, use_electron_density)
 
@@ -0,0 +1,129 @@
+import time
+import functools
+import tracemalloc
+import numpy as np
+
+# Functions called with a record dict after every instrumented stage
+# Stages run without any bookkeeping while the list is empty
+callbacks = []
+
+# Number of registered callbacks that want allocated bytes, tracemalloc is only used while it is nonzero,
+# and whether tracemalloc was started here
+tracing = {"callbacks": 0, "started": False}
+
+# Allocation peaks of the stages currently running, innermost last
+memory_stack = []
+
+def add_callback(callback, memory=False):
+    # callback(record) with record keys stage, seconds, events_in, events_out and bytes
+    # bytes is the peak traced allocation during the stage above the allocation at its start, None without memory
+    callbacks.append(callback)
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing["started"] = True
+        tracing["callbacks"] += 1
+    return callback
+
+def remove_callback(callback, memory=False):
+    callbacks.remove(callback)
+    if memory:
+        tracing["callbacks"] -= 1
+        # Only stop tracing started here
+        if tracing["callbacks"] == 0 and tracing["started"]:
+            tracemalloc.stop()
+            tracing["started"] = False
+
+def count_nonzero(res, n):
+    if isinstance(res, tuple):
+        return n
+    if np.ndim(res) == 0:
+        return n if res != 0 else 0
+    return int(np.count_nonzero(res))
+
+def stage(name, func, events, *args, **kwargs):
+    # func(events, *args, **kwargs), reported to the callbacks as stage name
+    if not callbacks:
+        return func(events, *args, **kwargs)
+    memory = tracing["callbacks"] > 0 and tracemalloc.is_tracing()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if memory_stack:
+            memory_stack[-1] = max(memory_stack[-1], peak)
+        tracemalloc.reset_peak()
+        memory_stack.append(current)
+        start_memory = current
+    start = time.perf_counter()
+    try:
+        res = func(events, *args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        if memory:
+            peak = max(memory_stack.pop(), tracemalloc.get_traced_memory()[1])
+            if memory_stack:
+                memory_stack[-1] = max(memory_stack[-1], peak)
+    n = len(events)
+    record = {
+            "stage": name,
+            "seconds": seconds,
+            "events_in": n,
+            "events_out": count_nonzero(res, n),
+            "bytes": peak - start_memory if memory else None,
+            }
+    for callback in list(callbacks):
+        callback(record)
+    return res
+
+def instrumented(method):
+    # Method decorator reporting calls as <class name>.<method name>
+    @functools.wraps(method)
+    def wrapper(self, events, *args, **kwargs):
+        if not callbacks:
+            return method(self, events, *args, **kwargs)
+        return stage(type(self).__name__ + "." + method.__name__, functools.partial(method, self), events, *args, **kwargs)
+    return wrapper
+
+class profiler:
+    # Collects the records of all instrumented stages while active
+    #   with LWpy.profiler(memory=True) as prof:
+    #       weights = w.weight(events)
+    #   print(prof.summary())
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self.active = False
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def start(self):
+        if not self.active:
+            add_callback(self, memory=self.memory)
+            self.active = True
+        return self
+
+    def stop(self):
+        if self.active:
+            remove_callback(self, memory=self.memory)
+            self.active = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def summary(self):
+        # Totals by stage; bytes is the largest peak of a single call
+        res = dict()
+        for r in self.records:
+            if r["stage"] not in res:
+                res[r["stage"]] = {"calls": 0, "seconds": 0.0, "events_in": 0, "events_out": 0, "bytes": None}
+            s = res[r["stage"]]
+            s["calls"] += 1
+            s["seconds"] += r["seconds"]
+            s["events_in"] += r["events_in"]
+            s["events_out"] += r["events_out"]
+            if r["bytes"] is not None:
+                s["bytes"] = r["bytes"] if s["bytes"] is None else max(s["bytes"], r["bytes"])
+        return res
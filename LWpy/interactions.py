@@ -1,7 +1,11 @@
-from .spline import spline_repo, eval_spline
+from .spline import spline_repo, bound_spline
 from .earth import earth
+from .vector import vector3
+from .instrument import instrumented
+from .event_batch import event_batch, as_events
 import numpy as np
 import scipy.special
+import hashlib
 import LeptonInjector
 
 class interaction:
@@ -19,16 +23,22 @@ class interaction:
                 *[LeptonInjector.Particle.ParticleType(p) for p in self.final_state]) == 2
 
     def total_cross_section(self, coords, grad=None):
-        spline = spline_repo[self.total_xs]
-        coords = np.asarray(coords).T
-        v = eval_spline(spline, coords, grad=grad) + 4
-        return v
+        # coords has shape (N, 1)
+        return self.total_cross_section_evaluator(grad)(np.asarray(coords).T)
 
     def differential_cross_section(self, coords, grad=None):
-        spline = spline_repo[self.differential_xs]
-        coords = np.asarray(coords).T
-        v = eval_spline(spline, coords, grad=grad) + 4
-        return v
+        # coords has shape (N, 3)
+        return self.differential_cross_section_evaluator(grad)(np.asarray(coords).T)
+
+    def total_cross_section_evaluator(self, grad=None):
+        # Evaluates the log10 total cross section on (1, N) coordinates
+        spline = bound_spline(spline_repo[self.total_xs], grad)
+        return lambda coords: spline(coords) + 4
+
+    def differential_cross_section_evaluator(self, grad=None):
+        # Evaluates the log10 differential cross section on (3, N) coordinates
+        spline = bound_spline(spline_repo[self.differential_xs], grad)
+        return lambda coords: spline(coords) + 4
 
 class interactions:
     def __init__(self, interactions_list):
@@ -67,6 +77,45 @@ class interactions:
 
             self.interactions_by_key[key] = i
 
+        self.build_signature_table()
+
+    def build_signature_table(self):
+        # Every known signature gets an integer code, its row in the lexicographically sorted signature table
+        # An event signature is mapped to a code through the position of each of its entries among the values
+        # known at that entry, combined into one index of a dense lookup table
+        signatures = sorted(set(self.interactions_by_signature.keys()))
+        width = len(signatures[0]) if len(signatures) > 0 else 0
+        assert(all(len(s) == width for s in signatures))
+        self.signature_table = np.array(signatures, dtype=int).reshape(len(signatures), width)
+        self.signature_values = [np.unique(column) for column in self.signature_table.T]
+        sizes = [len(v) for v in self.signature_values]
+        self.signature_strides = np.cumprod([1] + sizes[:0:-1])[::-1]
+        self.signature_lookup = np.full(int(np.prod(sizes)), -1, dtype=int)
+        for code, signature in enumerate(self.signature_table):
+            self.signature_lookup[self.signature_entry_index(signature[None,:])[0]] = code
+
+    def signature_entry_index(self, signature):
+        # Index into the dense lookup table, -1 where an entry has a value no known signature has there
+        n = len(signature)
+        res = np.zeros(n, dtype=int)
+        known = np.ones(n, dtype=bool)
+        for j, values in enumerate(self.signature_values):
+            column = signature[:,j]
+            pos = np.searchsorted(values, column)
+            pos[pos == len(values)] = 0
+            known &= values[pos] == column
+            res += pos * self.signature_strides[j]
+        res[~known] = -1
+        return res
+
+    def signature_codes(self, signature):
+        # Code of every row of an (n, signature size) array of signatures, -1 for unknown signatures
+        signature = np.asarray(signature).astype(int, copy=False)
+        if signature.ndim != 2 or signature.shape[1] != self.signature_table.shape[1] or len(self.signature_table) == 0:
+            return np.full(len(signature), -1, dtype=int)
+        entry = self.signature_entry_index(signature)
+        return np.where(entry >= 0, self.signature_lookup[entry], -1)
+
     def get_particle_interactions(self, particle):
         if particle in self.interactions_by_particle:
             return self.interactions_by_particle[particle]
@@ -81,96 +130,218 @@ class interactions:
         key = (name, particle, *final_state)
         return self.interactions_by_key[key]
 
+class interaction_context:
+    # Per event batch cache shared by the interaction_model.prob_* methods
+    # Keyed by the identity of the events and a fingerprint of the columns the model reads
+    # The events are held as an event_batch so derived columns are shared by the methods
+    columns = ["particle", "energy", "bjorken_x", "bjorken_y", "x", "y", "z", "zenith", "azimuth"]
+
+    def __init__(self, events):
+        self.key = interaction_context.identity(events)
+        self.version = interaction_context.fingerprint(events)
+        self.events = event_batch(events)
+        self.values = dict()
+
+    @staticmethod
+    def identity(events):
+        if isinstance(events, np.ndarray):
+            return (id(events), events.__array_interface__['data'][0], events.shape, events.dtype)
+        return (id(events), type(events).__name__, event_batch.source_length(events) if isinstance(events, dict) else len(events))
+
+    @staticmethod
+    def fingerprint(events):
+        h = hashlib.blake2b(digest_size=16)
+        if not isinstance(events, np.ndarray):
+            events = as_events(events)
+            names = events.names
+        else:
+            names = events.dtype.names
+        names = [n for n in names if n in interaction_context.columns or "final_type" in n]
+        for name in names:
+            h.update(name.encode('ascii'))
+            h.update(np.ascontiguousarray(events[name]).data)
+        return h.digest()
+
+    def __len__(self):
+        return len(self.events)
+
+    def matches(self, events):
+        return self.key == interaction_context.identity(events) and self.version == interaction_context.fingerprint(events)
+
+    def cached(self, key, fn):
+        if key not in self.values:
+            self.values[key] = fn()
+        return self.values[key]
+
+    per_event = ["differential_cross_section", "total_cross_section", "final_state_cross_section"]
+
+    def subset(self, index):
+        # Context for events[index] that inherits the per event cross sections already computed
+        ctx = interaction_context(self.events.take(index))
+        for key in interaction_context.per_event:
+            if key in self.values:
+                v = self.values[key]
+                ctx.values[key] = tuple(vv[index] for vv in v) if isinstance(v, tuple) else v[index]
+        return ctx
+
 class interaction_model(interactions, earth):
-    def __init__(self, interactions_list, earth_params):
+    def __init__(self, interactions_list, earth_params, earth_backend="EarthModelService"):
         interactions.__init__(self, interactions_list)
-        earth.__init__(self, earth_params)
+        earth.__init__(self, earth_params, backend=earth_backend)
         self.Na = 6.022140857e+23
+        self.last_context = None
+
+    def context(self, events):
+        # Reuse the cached signatures and cross sections while the same events are passed around
+        if isinstance(events, interaction_context):
+            return events
+        if not isinstance(events, (event_batch, dict)):
+            events = np.asarray(events)
+        if self.last_context is not None and self.last_context.matches(events):
+            return self.last_context
+        self.last_context = interaction_context(events)
+        return self.last_context
+
+    def particle_groups(self, ctx):
+        # Index of the events for every particle type, and the position of each event within its group
+        def compute():
+            particle = ctx.events["particle"]
+            groups = dict()
+            position = np.empty(len(particle), dtype=int)
+            for p in np.unique(particle).tolist():
+                index = np.nonzero(particle == p)[0]
+                groups[p] = index
+                position[index] = np.arange(len(index))
+            return groups, position
+        return ctx.cached("particle_groups", compute)
+
+    def signature_groups(self, ctx):
+        # (signature, event index, interactions) for every signature present in the events
+        def compute():
+            signature = ctx.events["signature"]
+            codes = self.signature_codes(signature)
+            unknown = codes < 0
+            if np.any(unknown):
+                sig_t = tuple(signature[np.argmax(unknown)].tolist())
+                raise KeyError(sig_t)
+            # Stable sort keeps the events of a signature in their original order
+            order = np.argsort(codes, kind='stable')
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(self.signature_table)))])
+            res = []
+            for code in np.flatnonzero(bounds[1:] > bounds[:-1]).tolist():
+                sig_t = tuple(self.signature_table[code].tolist())
+                index = order[bounds[code]:bounds[code+1]]
+                res.append((sig_t, index, self.interactions_by_signature[sig_t]))
+            return res
+        return ctx.cached("signature_groups", compute)
+
+    @staticmethod
+    def evaluate_by_file(work, coords):
+        # work is a list of (spline file, evaluate, key, event index), coords has shape (ndim, N)
+        # Interactions often share spline files, e.g. the NC splines of the three flavors, so every file is
+        # evaluated once on the events of all of its keys and the values are split back by key
+        files = dict()
+        for fname, evaluate, key, index in work:
+            if fname not in files:
+                files[fname] = (evaluate, [])
+            files[fname][1].append((key, index))
+        res = dict()
+        for fname, (evaluate, keys) in files.items():
+            # Keys with the same event index share their values
+            offsets = dict()
+            indices = []
+            n = 0
+            for key, index in keys:
+                if id(index) not in offsets:
+                    offsets[id(index)] = n
+                    indices.append(index)
+                    n += len(index)
+            values = evaluate(coords[:,np.concatenate(indices)])
+            for key, index in keys:
+                start = offsets[id(index)]
+                res[key] = values[start:start+len(index)]
+        return res
 
+    def interaction_total_cross_sections(self, ctx):
+        # Total cross section of every interaction on the events of its particle type
+        def compute():
+            groups, position = self.particle_groups(ctx)
+            coords = ctx.events["log10_energy"][None,:]
+            work = [(i.total_xs, i.total_cross_section_evaluator(), i.key, index)
+                    for p, index in groups.items() for i in self.get_particle_interactions(p)]
+            res = interaction_model.evaluate_by_file(work, coords)
+            return dict((key, 10.0**v) for key, v in res.items())
+        return ctx.cached("interaction_total_cross_sections", compute)
+
+    @instrumented
     def prob_kinematics(self, events):
-        events = np.asarray(events)
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape)
-        final_state = [events[s] for s in events.dtype.names if "final_type" in s]
-        particle = events["particle"]
-        energy = events["energy"]
-        x = events["bjorken_x"]
-        y = events["bjorken_y"]
-        coords = np.array([np.log10(energy), np.log10(x), np.log10(y)]).T
-
-        final_state = np.array(final_state).astype(int)
-        final_state = np.sort(final_state, axis=0)
-        signature = np.concatenate([particle[None,:], final_state]).T
-        unique_signatures = np.unique(signature, axis=0)
-        unique_signatures_t = [tuple(sig.tolist()) for sig in unique_signatures]
-        sig_masks = [np.all(signature == sig[None,:], axis=1) for sig in unique_signatures]
-        sig_interactions = [self.get_interactions(sig[0], sig[1:]) for sig in unique_signatures_t]
-        diff_xs = np.zeros(len(events)).astype(float)
-        total_xs = np.zeros(len(events)).astype(float)
-        for sig_mask, relevant_interactions in zip(sig_masks, sig_interactions):
-            for i in relevant_interactions:
-                diff_xs[sig_mask] += 10.0**(i.differential_cross_section(coords[sig_mask]))
-                total_xs[sig_mask] += 10.0**(i.total_cross_section(coords[sig_mask, :1]))
-        return diff_xs / total_xs
+        def compute():
+            coords = np.array([events["log10_energy"], events["log10_bjorken_x"], events["log10_bjorken_y"]])
+            groups = self.signature_groups(ctx)
+            work = [(i.differential_xs, i.differential_cross_section_evaluator(), i.key, index)
+                    for sig, index, relevant_interactions in groups for i in relevant_interactions]
+            values = interaction_model.evaluate_by_file(work, coords)
+            diff_xs = np.zeros(len(events)).astype(float)
+            for sig, index, relevant_interactions in groups:
+                for i in relevant_interactions:
+                    diff_xs[index] += 10.0**values[i.key]
+            return diff_xs
+        diff_xs = ctx.cached("differential_cross_section", compute)
+        p_fs_txs, e_fs_txs = self.get_final_state_cross_section(ctx)
+        return diff_xs / (p_fs_txs + e_fs_txs)
 
     def get_total_cross_section(self, events):
-        events = np.asarray(events)
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape), np.array(events["particle"].shape)
-        particle = events["particle"]
-        energy = events["energy"]
-        coords = np.array([np.log10(energy)]).T
-        particles = sorted(np.unique(particle))
-        p_indexing = dict(zip(particles, range(len(particles))))
-        p_masks = [particle == p for p in particles]
-        p_interactions = [self.get_particle_interactions(p) for p in particles]
-        p_p_txs = [[10.0**i.total_cross_section(coords[p_mask]) for i in p_int if not i.use_electron_density()] for p_int,p_mask,p in zip(p_interactions,p_masks,particles)]
-        p_e_txs = [[10.0**i.total_cross_section(coords[p_mask]) for i in p_int if i.use_electron_density()] for p_int,p_mask,p in zip(p_interactions,p_masks,particles)]
-        p_p_txs = [(0 if len(txs)==0 else np.sum(txs, axis=0)) for txs in p_p_txs]
-        p_e_txs = [(0 if len(txs)==0 else np.sum(txs, axis=0)) for txs in p_e_txs]
-
-        p_txs_res = np.empty(len(events))
-        e_txs_res = np.empty(len(events))
-        for p_txs, e_txs, mask in zip(p_p_txs, p_e_txs, p_masks):
-            p_txs_res[mask] = p_txs
-            e_txs_res[mask] = e_txs
-
-        return p_txs_res, e_txs_res
+        def compute():
+            groups, position = self.particle_groups(ctx)
+            txs = self.interaction_total_cross_sections(ctx)
+            p_txs_res = np.zeros(len(events))
+            e_txs_res = np.zeros(len(events))
+            for p, index in groups.items():
+                for i in self.get_particle_interactions(p):
+                    if i.use_electron_density():
+                        e_txs_res[index] += txs[i.key]
+                    else:
+                        p_txs_res[index] += txs[i.key]
+            return p_txs_res, e_txs_res
+        return ctx.cached("total_cross_section", compute)
 
     def get_final_state_cross_section(self, events):
-        events = np.asarray(events)
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape), np.array(events["particle"].shape)
-        particle = events["particle"]
-        energy = events["energy"]
-        coords = np.array([np.log10(energy)]).T
-        particles = sorted(np.unique(particle))
-        final_state = [events[s] for s in events.dtype.names if "final_type" in s]
-        final_state = np.array(final_state).astype(int)
-        final_state = np.sort(final_state, axis=0)
-        signature = np.concatenate([particle[None,:], final_state]).T
-        unique_signatures = np.unique(signature, axis=0)
-        unique_signatures_t = [tuple(sig.tolist()) for sig in unique_signatures]
-        sig_masks = [np.all(signature == sig[None,:], axis=1) for sig in unique_signatures]
-        sig_interactions = [self.get_interactions(sig[0], sig[1:]) for sig in unique_signatures_t]
-        s_p_txs = [[10.0**i.total_cross_section(coords[s_mask]) for i in s_int if not i.use_electron_density()] for s_int,s_mask,s in zip(sig_interactions,sig_masks,signature)]
-        s_e_txs = [[10.0**i.total_cross_section(coords[s_mask]) for i in s_int if i.use_electron_density()] for s_int,s_mask,s in zip(sig_interactions,sig_masks,signature)]
-
-        s_p_txs = [(0 if len(txs)==0 else np.sum(txs, axis=0)) for txs in s_p_txs]
-        s_e_txs = [(0 if len(txs)==0 else np.sum(txs, axis=0)) for txs in s_e_txs]
-
-        p_txs_res = np.empty(len(events))
-        e_txs_res = np.empty(len(events))
-        for p_txs, e_txs, mask in zip(s_p_txs, s_e_txs, sig_masks):
-            p_txs_res[mask] = p_txs
-            e_txs_res[mask] = e_txs
-
-        return p_txs_res, e_txs_res
+        def compute():
+            groups, position = self.particle_groups(ctx)
+            txs = self.interaction_total_cross_sections(ctx)
+            p_txs_res = np.zeros(len(events))
+            e_txs_res = np.zeros(len(events))
+            for sig, index, relevant_interactions in self.signature_groups(ctx):
+                for i in relevant_interactions:
+                    if i.use_electron_density():
+                        e_txs_res[index] += txs[i.key][position[index]]
+                    else:
+                        p_txs_res[index] += txs[i.key][position[index]]
+            return p_txs_res, e_txs_res
+        return ctx.cached("final_state_cross_section", compute)
 
 
     @staticmethod
     def log_one_m_mexp(val):
-        return np.log(val) - val/2. + val**2/24. - val**4/2880. if val < 1e-1 else np.log(1.-np.exp(-val))
+        val = np.asarray(val, dtype=float)
+        mask = val < 1e-1
+        res = np.empty(np.shape(val))
+        val_less, val_greater = val[mask], val[~mask]
+        res[mask] = np.log(val_less) - val_less/2. + val_less**2/24. - val_less**4/2880.
+        res[~mask] = np.log(1.-np.exp(-val_greater))
+        return res
 
     @staticmethod
     def one_m_mexp(val):
@@ -182,88 +353,83 @@ class interaction_model(interactions, earth):
         res[~mask] = 1.-np.exp(-val_greater)
         return res
 
+    @instrumented
     def prob_pos(self, events, first_pos, last_pos):
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape)
-        segments = list(reversed(self.GetDensitySegments(last_pos, first_pos)))
-
-        p_txs_res, e_txs_res = self.get_total_cross_section(events)
-
-        #total_column_depth_p = self.GetColumnDepthInCGS(last_pos, first_pos, False)
-        #total_column_depth_e = self.GetColumnDepthInCGS(last_pos, first_pos, True)
-
-        x = events["x"]
-        y = events["y"]
-        z = events["z"]
-        position = np.array([LeptonInjector.LI_Position(xx, yy, zz) for xx,yy,zz in zip(x,y,z)])
-
-        res = []
-
-        for i, (event, event_segments, p_xs, e_xs, f_p, l_p, pos) in enumerate(zip(events, segments, p_txs_res, e_txs_res, first_pos, last_pos, position)):
-            distance = (pos - f_p).Magnitude()
-            total_distance = (l_p - f_p).Magnitude()
-            s = []
-            exponential_i = []
-            exp_i = 0
-            segment_distance = 0
-            exponentials = []
-            got_segment = False
-            for segment in event_segments:
-                nucleon_density, electron_density, length = segment
-                nsigma = self.Na * (p_xs * nucleon_density + e_xs * electron_density) * 1e2 # target interactions per meter
-                if nsigma == 0:
-                    pass
-                    ss = np.sum(exponentials) - np.log(length)
-                else:
-                    ss = np.sum(exponentials) + self.log_one_m_mexp(nsigma*length) - np.log(nsigma)
-                s.append(ss)
-                exponential = -nsigma*length
-                exponentials.append(exponential)
-                segment_distance += length
-                if segment_distance > distance and not got_segment:
-                    got_segment = True
-                    exponential_i = list(exponentials)
-                    nsigma_i = nsigma
-                    x = distance - (segment_distance - length)
-                    exp_i = -nsigma_i*x
-
-            pos_density = np.exp(np.sum(exponential_i) + exp_i - scipy.special.logsumexp(s))
-            #nsigmax = self.Na * p_xs * total_column_depth_p[i] + e_xs * total_column_depth_e[i]
-            #nsigma = nsigmax / total_distance
-            #pos_density_2 = np.exp(-nsigma*distance + np.log(nsigma) - self.log_one_m_mexp(nsigmax))
-            #pos_density_3 = (1.0 - nsigma*distance)/total_distance
-            #print(total_distance, pos_density, pos_density_2/pos_density, pos_density_3/pos_density)
-            res.append(pos_density)
-
-        return np.array(res)
 
+        # Density segments ordered from first_pos to last_pos, padded into an (events, max segments) array
+        offsets, nucleon_density, electron_density, length = self.GetDensitySegmentArrays(first_pos, last_pos)
+        counts = np.diff(offsets)
+        n_events = len(counts)
+        n_segments = max(int(np.max(counts)), 1)
+        event_index = np.repeat(np.arange(n_events), counts)
+        segment_index = np.arange(len(length)) - offsets[event_index]
+
+        p_txs_res, e_txs_res = self.get_total_cross_section(ctx)
+
+        # target interactions per meter
+        nsigma = self.Na * (p_txs_res[event_index] * nucleon_density + e_txs_res[event_index] * electron_density) * 1e2
+
+        padded_nsigma = np.zeros((n_events, n_segments))
+        padded_length = np.zeros((n_events, n_segments))
+        padded_nsigma[event_index, segment_index] = nsigma
+        padded_length[event_index, segment_index] = length
+        valid = np.arange(n_segments)[None,:] < counts[:,None]
+
+        # Optical depth accumulated before each segment, and the log of the integral of exp(-depth) over each segment
+        depth = padded_nsigma * padded_length
+        depth_before = np.cumsum(depth, axis=1) - depth
+        log_integral = np.full((n_events, n_segments), -np.inf)
+        absorbing = np.logical_and(valid, padded_nsigma > 0)
+        transparent = np.logical_and(valid, padded_nsigma == 0)
+        log_integral[absorbing] = -depth_before[absorbing] + self.log_one_m_mexp(depth[absorbing]) - np.log(padded_nsigma[absorbing])
+        log_integral[transparent] = -depth_before[transparent] + np.log(padded_length[transparent])
+        log_norm = scipy.special.logsumexp(log_integral, axis=1)
+
+        position = events["position"]
+        first_pos = vector3.as_vector3(first_pos)
+        distance = (position - first_pos).magnitude()
+
+        # Segment containing each interaction vertex
+        segment_end = np.cumsum(padded_length, axis=1)
+        i = np.minimum(np.sum(segment_end <= distance[:,None], axis=1), np.maximum(counts-1, 0))
+        rows = np.arange(n_events)
+        depth_at = depth_before[rows, i] + padded_nsigma[rows, i] * (distance - (segment_end[rows, i] - padded_length[rows, i]))
+
+        return np.exp(-depth_at - log_norm)
+
+    @instrumented
     def prob_interaction(self, events, first_pos, last_pos):
-        events = np.asarray(events)
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape)
 
         total_column_depth_p = self.GetColumnDepthInCGS(first_pos, last_pos, False)
         total_column_depth_e = self.GetColumnDepthInCGS(first_pos, last_pos, True)
 
-        p_txs, e_txs = self.get_total_cross_section(events)
+        p_txs, e_txs = self.get_total_cross_section(ctx)
 
         exponent = self.Na * (p_txs * total_column_depth_p + e_txs * total_column_depth_e)
         #print(total_column_depth_p / events["total_column_depth"])
         return self.one_m_mexp(exponent)
 
+    @instrumented
     def prob_final_state(self, events):
+        ctx = self.context(events)
+        events = ctx.events
         if len(events) == 0:
             return np.array(events["particle"].shape)
-        x = events["x"]
-        y = events["y"]
-        z = events["z"]
-        position = np.array([LeptonInjector.LI_Position(xx, yy, zz) for xx,yy,zz in zip(x,y,z)])
+        position = events["position"]
 
         p_density = self.GetDensityInCGS(position)
         e_density = p_density * self.GetPNERatio(position)
 
-        p_txs, e_txs = self.get_total_cross_section(events)
-        p_fs_txs, e_fs_txs = self.get_final_state_cross_section(events)
+        p_txs, e_txs = self.get_total_cross_section(ctx)
+        p_fs_txs, e_fs_txs = self.get_final_state_cross_section(ctx)
         return (p_fs_txs * p_density + e_fs_txs * e_density) / (p_txs * p_density + e_txs * e_density)
 
 import pathlib
@@ -1,13 +1,70 @@
 import os
+import io
+import mmap
 import struct
 import hashlib
+from .spline_store import spline_store
 
-class read_stream:
-    def __init__(self, fname, spline_dir='./'):
-        f = open(fname, 'rb')
-        self.data = f.read()
+class spline_blob:
+    # Spline embedded in a .lic file that has not been read yet
+    def __init__(self, fname, offset, length):
+        self.fname = fname
+        self.offset = offset
+        self.length = length
+        self.names = dict()
+        self.hash = None
+
+    def read(self):
+        f = open(self.fname, 'rb')
+        f.seek(self.offset)
+        data = f.read(self.length)
         f.close()
+        return data
+
+    def materialize(self, spline_dir='./'):
+        # Write the spline to spline_dir and return its file name
+        if spline_dir not in self.names:
+            self.names[spline_dir] = spline_store.get(spline_dir).add(self.read())
+        return self.names[spline_dir]
+
+    def digest(self):
+        # Hash of the contents, computed once per blob
+        if self.hash is None:
+            self.hash = hashlib.sha512(self.read()).hexdigest()
+        return self.hash
+
+    def __eq__(self, other):
+        if not isinstance(other, spline_blob):
+            return NotImplemented
+        if (self.fname, self.offset, self.length) == (other.fname, other.offset, other.length):
+            return True
+        return self.length == other.length and self.digest() == other.digest()
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    def __hash__(self):
+        return hash(self.digest())
+
+    def __repr__(self):
+        return "spline_blob(" + repr(self.fname) + ", " + str(self.offset) + ", " + str(self.length) + ")"
+
+class read_stream:
+    # Parses the file through a read-only memory map without copying
+    # With index_only the embedded splines are returned as spline_blob objects instead of being written to spline_dir
+    def __init__(self, fname, spline_dir='./', index_only=False):
+        self.fname = fname
+        self.file = open(fname, 'rb')
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+        self.view = memoryview(self.data)
         self.spline_dir = spline_dir
+        self.index_only = index_only
         self.pos = 0
         self.size_size = 8
         self.enum_size_size = 4
@@ -15,11 +72,28 @@ class read_stream:
         self.double_size = 8
         self.particle_size = 4
 
+    def close(self):
+        self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def read_bin(self, n):
-        v = self.data[self.pos:self.pos+n]
+        v = self.view[self.pos:self.pos+n]
         self.pos += n
         return v
 
+    def skip_bin(self, n):
+        pos = self.pos
+        self.pos += n
+        return pos
+
     def read_int(self, n, endian='little', signed=False):
         val = int.from_bytes(self.read_bin(n), endian, signed=signed)
         return val
@@ -31,8 +105,8 @@ class read_stream:
             e = '>'
         else:
             e = ''
-        d = self.read_bin(self.float_size)
-        v = struct.unpack(e+'f', d)[0]
+        v = struct.unpack_from(e+'f', self.data, self.pos)[0]
+        self.pos += self.float_size
         return v
 
     def read_double(self, endian='little', signed=True):
@@ -42,13 +116,13 @@ class read_stream:
             e = '>'
         else:
             e = ''
-        d = self.read_bin(self.double_size)
-        v = struct.unpack(e+'d', d)[0]
+        v = struct.unpack_from(e+'d', self.data, self.pos)[0]
+        self.pos += self.double_size
         return v
 
     def read_string(self, endian='little', signed=False):
         v = self.read_int(self.size_size, signed=signed)
-        s = self.read_bin(v).decode('ascii')
+        s = str(self.read_bin(v), 'ascii')
         return s
 
     def read_block_header(self):
@@ -81,27 +155,20 @@ class read_stream:
         final_type_0 = self.read_int(self.particle_size, signed=True)
         final_type_1 = self.read_int(self.particle_size, signed=True)
         xs_size = self.read_int(self.size_size)
-        xs_data = self.read_bin(xs_size)
+        xs_offset = self.skip_bin(xs_size)
         txs_size = self.read_int(self.size_size)
-        txs_data = self.read_bin(txs_size)
+        txs_offset = self.skip_bin(txs_size)
         radius = self.read_double()
         height = self.read_double()
-        xs_hash = hashlib.sha512(xs_data).hexdigest()
-        xs_name = xs_hash + '.fits'
-        txs_hash = hashlib.sha512(txs_data).hexdigest()
-        txs_name = txs_hash + '.fits'
-
-        for name, x_hash, data in [[xs_name, xs_hash, xs_data], [txs_name, txs_hash, txs_data]]:
-            check = False
-            name = os.path.join(self.spline_dir, name)
-            if os.path.isfile(name):
-                f = open(name, 'rb')
-                check_data = f.read()
-                f.close()
-                check_hash = hashlib.sha512(data).hexdigest()
-                check = x_hash == check_hash
-            if not check:
-                open(name, 'wb').write(data)
+
+        if self.index_only:
+            fname = os.path.abspath(self.fname)
+            xs_name = spline_blob(fname, xs_offset, xs_size)
+            txs_name = spline_blob(fname, txs_offset, txs_size)
+        else:
+            store = spline_store.get(self.spline_dir)
+            xs_name = store.add(self.view[xs_offset:xs_offset+xs_size])
+            txs_name = store.add(self.view[txs_offset:txs_offset+txs_size])
 
         d = {
                 "events": events,
@@ -146,11 +213,13 @@ class read_stream:
 
 
 class write_stream:
-    def __init__(self, fname, spline_dir='./'):
+    # Streams the blocks to fname, which may be a path or a binary file object
+    # Block sizes are back-patched into the headers, so memory does not grow with the file
+    def __init__(self, fname, spline_dir='./', copy_size=1<<20):
         self.fname = fname
-        self.data = bytearray(0)
+        self.file = None
         self.spline_dir = spline_dir
-        self.pos = 0
+        self.copy_size = copy_size
         self.size_size = 8
         self.enum_size_size = 4
         self.float_size = 4
@@ -158,9 +227,17 @@ class write_stream:
         self.particle_size = 4
 
     def write_bin(self, data):
-        self.data = self.data[:self.pos] + data + self.data[self.pos:]
-        n = len(data)
-        self.pos += n
+        self.file.write(data)
+        return len(data)
+
+    def copy_bin(self, f, size):
+        # Copy size bytes from the file object f in bounded pieces
+        n = 0
+        while n < size:
+            data = f.read(min(self.copy_size, size - n))
+            if len(data) == 0:
+                raise ValueError("Unexpected end of spline data")
+            n += self.write_bin(data)
         return n
 
     def write_int(self, val, n, endian='little', signed=False):
@@ -205,15 +282,27 @@ class write_stream:
         return n
 
     def write_block(self, block, writer):
-        n = 0
         block_name, block_version, block, = block
-        pos0 = self.pos
-        block_size = writer(block, version=block_version)
-        n += block_size
-        self.pos = pos0
-        n += self.write_block_header(block_size, block_name, block_version)
-        self.pos += block_size
-        return n
+        out = self.file
+        if out.seekable():
+            size_pos = out.tell()
+            n = self.write_block_header(0, block_name, block_version)
+            block_size = writer(block, version=block_version)
+            end_pos = out.tell()
+            out.seek(size_pos)
+            out.write(block_size.to_bytes(self.size_size, 'little'))
+            out.seek(end_pos)
+        else:
+            # The header cannot be patched afterwards, so only this block is buffered
+            self.file = io.BytesIO()
+            try:
+                block_size = writer(block, version=block_version)
+                body = self.file
+            finally:
+                self.file = out
+            n = self.write_block_header(block_size, block_name, block_version)
+            out.write(body.getbuffer())
+        return n + block_size
 
     def write_enum_block(self, block, version=1):
         n = 0
@@ -228,6 +317,15 @@ class write_stream:
             n += self.write_string(enum_name)
         return n
 
+    def open_spline(self, spline):
+        # Open file positioned at the spline data and the size of the data
+        if isinstance(spline, spline_blob):
+            f = open(spline.fname, 'rb')
+            f.seek(spline.offset)
+            return f, spline.length
+        f = open(os.path.join(self.spline_dir, spline), 'rb')
+        return f, os.fstat(f.fileno()).st_size
+
     def write_volume_block(self, block, version=1):
         n = 0
         events = block["events"]
@@ -245,16 +343,6 @@ class write_stream:
         radius = block["radius"]
         height = block["height"]
 
-        txs_data = open(os.path.join(self.spline_dir, totalCrossSection), 'rb').read()
-        xs_data = open(os.path.join(self.spline_dir, differentialCrossSection), 'rb').read()
-        txs_size = len(txs_data)
-        xs_size = len(xs_data)
-
-        xs_hash = hashlib.sha512(xs_data).hexdigest()
-        xs_name = xs_hash + '.fits'
-        txs_hash = hashlib.sha512(txs_data).hexdigest()
-        txs_name = txs_hash + '.fits'
-
         n += self.write_int(events, 4)
         n += self.write_double(energy_min)
         n += self.write_double(energy_max)
@@ -265,10 +353,13 @@ class write_stream:
         n += self.write_double(zenith_max)
         n += self.write_int(final_type_0, self.particle_size, signed=True)
         n += self.write_int(final_type_1, self.particle_size, signed=True)
-        n += self.write_int(xs_size, self.size_size)
-        n += self.write_bin(xs_data)
-        n += self.write_int(txs_size, self.size_size)
-        n += self.write_bin(txs_data)
+        for spline in [differentialCrossSection, totalCrossSection]:
+            f, size = self.open_spline(spline)
+            try:
+                n += self.write_int(size, self.size_size)
+                n += self.copy_bin(f, size)
+            finally:
+                f.close()
         n += self.write_double(radius)
         n += self.write_double(height)
         return n
@@ -281,6 +372,20 @@ class write_stream:
         return self.write_volume_block(block, version=version)
 
     def write(self, blocks):
+        n = 0
+        if hasattr(self.fname, 'write'):
+            self.file = self.fname
+        else:
+            self.file = open(self.fname, 'wb')
+        try:
+            n = self.write_blocks(blocks)
+        finally:
+            if self.file is not self.fname:
+                self.file.close()
+            self.file = None
+        return n
+
+    def write_blocks(self, blocks):
         n = 0
         for block in blocks:
             block_name, block_vesion, block_data = block
@@ -293,7 +398,4 @@ class write_stream:
             else:
                 raise ValueError("Unrecognized block! " + block_name)
             pass
-        f = open(self.fname, 'wb')
-        f.write(bytes(self.data))
-        f.close()
         return n
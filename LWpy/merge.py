@@ -0,0 +1,64 @@
+import os
+import sys
+import argparse
+import multiprocessing
+from .lic import read_stream
+from .lic import write_stream
+from .block import block_key
+from .block import block_merger
+from .spline_store import temporary_file
+
+def read_index(fname):
+    # Blocks of one file with the spline blobs left on disk
+    # Keys are computed here so that the blob hashes travel back with the blocks
+    with read_stream(fname, index_only=True) as s:
+        blocks = s.read()
+    for block in blocks:
+        block_key(block)
+    return blocks
+
+def merge_files(fnames, output, workers=1):
+    # Fold the blocks of all files into output
+    # Only the merged blocks are kept in memory, embedded splines are copied straight from the input files
+    merger = block_merger()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for blocks in pool.imap(read_index, fnames):
+                merger.add_blocks(blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for fname in fnames:
+            merger.add_blocks(read_index(fname))
+
+    # Write next to the output and rename, the output may be one of the inputs
+    fd, tmp = temporary_file(os.path.abspath(output))
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            write_stream(f).write(merger.blocks())
+        finally:
+            f.close()
+        os.replace(tmp, output)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return merger.blocks()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge LeptonInjector configuration (.lic) files")
+    parser.add_argument("inputs", nargs="+", help="input .lic files")
+    parser.add_argument("-o", "--output", required=True, help="merged .lic file")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of processes parsing the input files")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("need at least one worker")
+    blocks = merge_files(args.inputs, args.output, workers=args.workers)
+    print("Merged " + str(len(args.inputs)) + " files into " + str(len(blocks)) + " blocks")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
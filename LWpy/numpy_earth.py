@@ -0,0 +1,291 @@
+import os
+import numpy as np
+
+def read_density_file(fname):
+    # format: upper_radius[m] label MediumType n_params params...
+    layers = []
+    with open(fname, 'r') as f:
+        for line in f:
+            if len(line) == 0 or line[0] in '#' or line[0].isspace():
+                continue
+            line = line.split('#')[0].split()
+            if len(line) < 4:
+                continue
+            upper_radius = float(line[0])
+            label = line[1]
+            medium = line[2]
+            n = int(line[3])
+            params = [float(p) for p in line[4:4+n]]
+            layers.append((upper_radius, label, medium, params))
+    return layers
+
+def read_material_file(fname):
+    # format: MediumType n_materials, followed by n_materials lines of pdg weight
+    materials = dict()
+    with open(fname, 'r') as f:
+        lines = [l.split('#')[0] for l in f if len(l) > 0 and l[0] != '#' and not l[0].isspace()]
+    lines = [l.split() for l in lines if len(l.split()) > 0]
+    i = 0
+    while i < len(lines):
+        medium = lines[i][0]
+        n = int(lines[i][1])
+        materials[medium] = [(int(pdg), float(w)) for pdg, w in lines[i+1:i+1+n]]
+        i += 1 + n
+    return materials
+
+def pne_ratio(material):
+    # electrons (== protons) per nucleon for a list of (pdg, mass fraction)
+    # nuclear pdg codes are 10LZZZAAAI
+    res = 0.0
+    for pdg, weight in material:
+        Z = (pdg // 10000) % 1000
+        A = (pdg // 10) % 1000
+        res += weight * float(Z) / float(A)
+    return res
+
+class numpy_earth:
+    def __init__(self, name, tablepath, earthmodels, materialmodels, icecapname="NoIce", icecapangle=0.0, detectordepth=0.0, chunk_size=1<<14):
+        if icecapname != "NoIce":
+            raise ValueError("numpy_earth only supports icecapname=\"NoIce\", got " + str(icecapname))
+        self.name = name
+        self.chunk_size = int(chunk_size)
+
+        layers = dict()
+        for model in earthmodels:
+            for layer in read_density_file(os.path.join(tablepath, 'densities', model + '.dat')):
+                layers[layer[0]] = layer
+        layers = [layers[r] for r in sorted(layers.keys())]
+        if len(layers) == 0:
+            raise ValueError("No density layers found for " + str(earthmodels))
+
+        materials = dict()
+        for model in materialmodels:
+            materials.update(read_material_file(os.path.join(tablepath, 'materials', model + '.dat')))
+
+        self.labels = [l[1] for l in layers]
+        self.media = [l[2] for l in layers]
+        self.radii = np.array([l[0] for l in layers], dtype=float)
+        self.atmo_radius = self.radii[-1]
+        self.earth_radius = self.radii[-2] if len(self.radii) > 1 else self.radii[-1]
+        self.detector_depth = float(detectordepth)
+        self.detector_position = np.array([0.0, 0.0, self.earth_radius - self.detector_depth])
+
+        # Polynomial coefficients in r [m], padded with a final vacuum layer outside the atmosphere
+        # Distances are rescaled by the atmosphere radius to keep the closed form integrals well conditioned
+        self.scale = self.atmo_radius
+        n_params = max([len(l[3]) for l in layers])
+        coefficients = np.zeros((len(layers)+1, n_params))
+        for i, l in enumerate(layers):
+            coefficients[i, :len(l[3])] = l[3]
+        self.coefficients = coefficients
+        self.scaled_coefficients = coefficients * self.scale**np.arange(n_params)[None,:]
+
+        pne = []
+        for medium in self.media + ["VACUUM"]:
+            if medium in materials:
+                pne.append(pne_ratio(materials[medium]))
+            elif medium == "VACUUM":
+                pne.append(1.0)
+            else:
+                raise ValueError("No material definition for medium " + medium)
+        self.pne = np.array(pne)
+
+    def GetEarthRadius(self):
+        return self.earth_radius
+
+    def GetAtmoRadius(self):
+        return self.atmo_radius
+
+    def GetEarthCoordPosFromDetCoordPos(self, position):
+        return np.asarray(position, dtype=float) + self.detector_position
+
+    def GetDetCoordPosFromEarthCoordPos(self, position):
+        return np.asarray(position, dtype=float) - self.detector_position
+
+    def layer_index(self, r):
+        # Index of the layer containing radius r, len(self.radii) for vacuum
+        return np.searchsorted(self.radii, r, side='left')
+
+    def density(self, r, layer):
+        c = self.coefficients[layer]
+        res = np.zeros(np.shape(r))
+        for k in reversed(range(c.shape[-1])):
+            res = res * r + c[..., k]
+        return res
+
+    def antiderivative(self, s, b, layer):
+        # Closed form of int rho(sqrt(b^2 + s^2)) ds in scaled units for the polynomial of each layer
+        # Uses J_n = int x^n ds = (s x^n + n b^2 J_{n-2}) / (n+1) with x^2 = b^2 + s^2
+        c = self.scaled_coefficients[layer]
+        b2 = b*b
+        x = np.sqrt(b2 + s*s)
+        positive = b > 0
+        asinh = np.zeros(np.shape(x))
+        np.copyto(asinh, b2 * np.arcsinh(s / np.where(positive, b, 1.0)), where=positive)
+        J = [s, 0.5*(s*x + asinh)]
+        res = c[..., 0] * J[0]
+        if c.shape[-1] > 1:
+            res += c[..., 1] * J[1]
+        x_n = x
+        for n in range(2, c.shape[-1]):
+            x_n = x_n * x
+            J_n = (s * x_n + n * b2 * J[n-2]) / (n + 1)
+            J.append(J_n)
+            res += c[..., n] * J_n
+        return res
+
+    def line_segments(self, p0, u, length):
+        # Split the lines p0 + t*u, t in [0, length] at every layer boundary
+        # Returns the sorted break points in t, the scaled impact parameter and pca offset, and the layer of each piece
+        p0 = p0 / self.scale
+        length = length / self.scale
+        t_pca = -np.sum(p0 * u, axis=1)
+        b2 = np.maximum(np.sum(p0 * p0, axis=1) - t_pca * t_pca, 0.0)
+        radii = self.radii / self.scale
+        h2 = radii[None,:]**2 - b2[:,None]
+        valid = h2 > 0
+        h = np.sqrt(np.where(valid, h2, 0.0))
+        crossings = np.concatenate([t_pca[:,None] - h, t_pca[:,None] + h], axis=1)
+        crossings = np.where(np.concatenate([valid, valid], axis=1), crossings, 0.0)
+        points = np.concatenate([np.zeros((len(p0), 1)), length[:,None], crossings], axis=1)
+        points = np.sort(np.clip(points, 0.0, length[:,None]), axis=1)
+        t_mid = 0.5 * (points[:,1:] + points[:,:-1])
+        r_mid = np.sqrt(b2[:,None] + (t_mid - t_pca[:,None])**2) * self.scale
+        layer = self.layer_index(r_mid)
+        return points, np.sqrt(b2), t_pca, layer
+
+    def segment_column_depths(self, points, b, t_pca, layer, use_electron_density=False):
+        s = points - t_pca[:,None]
+        F = self.antiderivative(s[:,:-1], b[:,None], layer), self.antiderivative(s[:,1:], b[:,None], layer)
+        cdep = (F[1] - F[0]) * self.scale * 1e2 # g/cm^3 * m -> g/cm^2
+        if use_electron_density:
+            cdep = cdep * self.pne[layer]
+        return cdep
+
+    def chunks(self, n):
+        for i in range(0, n, self.chunk_size):
+            yield slice(i, min(i + self.chunk_size, n))
+
+    @staticmethod
+    def normalize(v):
+        v = np.asarray(v, dtype=float)
+        length = np.sqrt(np.sum(v * v, axis=1))
+        u = v / np.where(length > 0, length, 1.0)[:,None]
+        return u, length
+
+    def GetDensityInCGS(self, position):
+        position = self.GetEarthCoordPosFromDetCoordPos(np.reshape(position, (-1, 3)))
+        r = np.sqrt(np.sum(position * position, axis=1))
+        return self.density(r, self.layer_index(r))
+
+    def GetPNERatio(self, position):
+        position = self.GetEarthCoordPosFromDetCoordPos(np.reshape(position, (-1, 3)))
+        r = np.sqrt(np.sum(position * position, axis=1))
+        return self.pne[self.layer_index(r)]
+
+    def GetColumnDepthInCGS(self, p0, p1, use_electron_density=False):
+        p0 = self.GetEarthCoordPosFromDetCoordPos(np.reshape(p0, (-1, 3)))
+        p1 = self.GetEarthCoordPosFromDetCoordPos(np.reshape(p1, (-1, 3)))
+        u, length = self.normalize(p1 - p0)
+        res = np.empty(len(p0))
+        for c in self.chunks(len(p0)):
+            points, b, t_pca, layer = self.line_segments(p0[c], u[c], length[c])
+            res[c] = np.sum(self.segment_column_depths(points, b, t_pca, layer, use_electron_density), axis=1)
+        return res
+
+    def GetDensitySegmentArrays(self, p0, p1):
+        # Constant density approximation of the path from p0 to p1, one segment for every layer crossed,
+        # in order from p0 to p1, as flat arrays indexed by offsets (CSR layout)
+        # Returns offsets, nucleon density, electron density [g/cm^3] and segment length [m]
+        p0 = self.GetEarthCoordPosFromDetCoordPos(np.reshape(p0, (-1, 3)))
+        p1 = self.GetEarthCoordPosFromDetCoordPos(np.reshape(p1, (-1, 3)))
+        u, length = self.normalize(p1 - p0)
+        counts = []
+        nucleon_density = []
+        electron_density = []
+        seg_length = []
+        for c in self.chunks(len(p0)):
+            points, b, t_pca, layer = self.line_segments(p0[c], u[c], length[c])
+            cdep = self.segment_column_depths(points, b, t_pca, layer)
+            l = np.diff(points, axis=1) * self.scale
+            nonzero = l > 0
+            counts.append(np.sum(nonzero, axis=1))
+            l = l[nonzero]
+            n = cdep[nonzero] / l * 1e-2
+            nucleon_density.append(n)
+            electron_density.append(n * self.pne[layer[nonzero]])
+            seg_length.append(l)
+        offsets = np.zeros(len(p0)+1, dtype=int)
+        if len(p0) > 0:
+            np.cumsum(np.concatenate(counts), out=offsets[1:])
+            return offsets, np.concatenate(nucleon_density), np.concatenate(electron_density), np.concatenate(seg_length)
+        return offsets, np.zeros(0), np.zeros(0), np.zeros(0)
+
+    def GetDensitySegments(self, p0, p1):
+        # Segments as a list of (nucleon density, electron density, length [m]) for every path
+        offsets, nucleon_density, electron_density, length = self.GetDensitySegmentArrays(p0, p1)
+        res = []
+        for i0, i1 in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            res.append(list(zip(nucleon_density[i0:i1].tolist(), electron_density[i0:i1].tolist(), length[i0:i1].tolist())))
+        return res
+
+    def sphere_intersections(self, position, direction, radius):
+        # Parameters t0 <= t1 of position + t*direction on the sphere, nan if there is no intersection
+        pu = np.sum(position * direction, axis=1)
+        disc = pu*pu - np.sum(position * position, axis=1) + radius*radius
+        root = np.sqrt(np.where(disc >= 0, disc, np.nan))
+        return -pu - root, -pu + root
+
+    def GetAtmoPoints(self, pca, direction):
+        pca = self.GetEarthCoordPosFromDetCoordPos(np.reshape(pca, (-1, 3)))
+        direction, _ = self.normalize(np.reshape(direction, (-1, 3)))
+        t0, t1 = self.sphere_intersections(pca, direction, self.atmo_radius)
+        hit = np.isfinite(t0)
+        # Mirror EarthModelService which leaves the points at the earth center when the sphere is missed
+        entry = np.where(hit[:,None], pca + t0[:,None] * direction, 0.0)
+        exit = np.where(hit[:,None], pca + t1[:,None] * direction, 0.0)
+        return self.GetDetCoordPosFromEarthCoordPos(entry), self.GetDetCoordPosFromEarthCoordPos(exit)
+
+    def DistanceForColumnDepthToPoint(self, p0, d0, col, use_electron_density=False, iterations=40):
+        # Distance from p0 backwards along d0 that accumulates a column depth of col
+        # Saturates at the atmosphere boundary when there is not enough matter
+        p0 = self.GetEarthCoordPosFromDetCoordPos(np.reshape(p0, (-1, 3)))
+        u, _ = self.normalize(np.reshape(d0, (-1, 3)))
+        u = -u
+        col = np.broadcast_to(np.asarray(col, dtype=float), (len(p0),))
+        _, t_max = self.sphere_intersections(p0, u, self.atmo_radius)
+        t_max = np.maximum(np.nan_to_num(t_max, nan=0.0), 0.0)
+        res = np.empty(len(p0))
+        for c in self.chunks(len(p0)):
+            points, b, t_pca, layer = self.line_segments(p0[c], u[c], t_max[c])
+            cdep = self.segment_column_depths(points, b, t_pca, layer, use_electron_density)
+            cumulative = np.cumsum(cdep, axis=1)
+            target = col[c]
+            i = np.sum(cumulative < target[:,None], axis=1)
+            done = i >= cdep.shape[1]
+            i = np.minimum(i, cdep.shape[1]-1)
+            rows = np.arange(len(i))
+            before = cumulative[rows, i] - cdep[rows, i]
+            remaining = (target - before) / (self.scale * 1e2)
+            lo = points[rows, i]
+            hi = points[rows, i+1]
+            l = layer[rows, i]
+            if use_electron_density:
+                remaining = remaining / self.pne[l]
+            piece = self.antiderivative(hi - t_pca, b, l) - self.antiderivative(lo - t_pca, b, l)
+            F_lo = self.antiderivative(lo - t_pca, b, l)
+            # Safeguarded Newton iterations for int_lo^t rho = remaining within the piece
+            a = lo.copy()
+            z = hi.copy()
+            t = lo + (hi - lo) * np.clip(remaining / np.where(piece > 0, piece, 1.0), 0.0, 1.0)
+            for _ in range(iterations):
+                f = self.antiderivative(t - t_pca, b, l) - F_lo - remaining
+                a = np.where(f < 0, t, a)
+                z = np.where(f >= 0, t, z)
+                rho = self.density(np.sqrt(b*b + (t - t_pca)**2) * self.scale, l)
+                newton = t - f / np.where(rho > 0, rho, np.inf)
+                bad = ~np.logical_and(newton > a, newton < z)
+                t = np.where(bad, 0.5 * (a + z), newton)
+            t = np.where(done, points[:,-1], t)
+            res[c] = t * self.scale
+        return res
@@ -0,0 +1,106 @@
+import multiprocessing
+import functools
+import numpy as np
+from .vector import vector3
+from .event_batch import event_batch, as_events
+
+# Object owned by the current worker process
+_worker_obj = None
+
+def _init_worker(cls, args, kwargs):
+    global _worker_obj
+    _worker_obj = cls(*args, **kwargs)
+
+def _call_worker(task):
+    method, args = task
+    return getattr(_worker_obj, method)(*args)
+
+def split_args(n, args, n_chunks):
+    # Split every per event argument (length n) into n_chunks contiguous pieces
+    # Other arguments are passed unchanged to each chunk
+    bounds = np.linspace(0, n, n_chunks+1).astype(int)
+    chunks = []
+    for i in range(n_chunks):
+        chunk = []
+        for a in args:
+            if isinstance(a, (np.ndarray, vector3)) and np.ndim(a) > 0 and len(a) == n:
+                a = a[bounds[i]:bounds[i+1]]
+            chunk.append(a)
+        chunks.append(tuple(chunk))
+    return chunks
+
+def join_results(results, lengths=None):
+    # Concatenate the per chunk results, keeping the structure of a single result
+    # Scalar results (e.g. prob_area or prob_stat) are returned as they are when every chunk gives a scalar,
+    # and broadcast to the chunk lengths otherwise
+    first = results[0]
+    if isinstance(first, tuple):
+        return tuple(join_results(list(r), lengths) for r in zip(*results))
+    if isinstance(first, vector3):
+        return vector3(np.concatenate([r.xyz for r in results]))
+    if all(np.ndim(r) == 0 for r in results):
+        return first
+    if lengths is not None:
+        results = [np.broadcast_to(r, (n,)) if np.ndim(r) == 0 else r for r, n in zip(results, lengths)]
+    return np.concatenate([np.asarray(r) for r in results])
+
+class parallel:
+    # Evaluate methods of an LWpy object on chunks of events in a process pool
+    # Each worker constructs its own object from cls(*args, **kwargs) once, so earth models and splines
+    # are never pickled; cls and its arguments must be picklable
+    # Chunk boundaries only depend on the number of events and results are stitched back in order,
+    # so the output does not depend on scheduling
+    #   p = LWpy.parallel(LWpy.volume_generator, block, spline_dir=spline_dir, workers=8)
+    #   probs = p.prob(events)
+    def __init__(self, cls, *args, workers=None, chunk_size=1<<14, **kwargs):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = int(workers)
+        if workers < 1:
+            raise ValueError("Need at least one worker, got " + str(workers))
+        if chunk_size < 1:
+            raise ValueError("Need a positive chunk size, got " + str(chunk_size))
+        self.workers = workers
+        self.chunk_size = int(chunk_size)
+        self.obj = None
+        self.pool = None
+        if workers == 1:
+            self.obj = cls(*args, **kwargs)
+        else:
+            self.pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(cls, args, kwargs))
+
+    def n_chunks(self, n):
+        return max(1, -(-n // self.chunk_size))
+
+    def map(self, method, events, *args):
+        # Call method(events, *args) on chunks of events
+        # Array and vector3 arguments with one entry per event are split along with the events
+        n = len(events)
+        if self.obj is None and self.pool is None:
+            raise ValueError("The worker pool has been closed")
+        if self.pool is None:
+            return getattr(self.obj, method)(events, *args)
+        if isinstance(events, (event_batch, dict)):
+            # Workers get plain structured arrays
+            events = as_events(events).records()
+        n_chunks = self.n_chunks(n)
+        chunks = split_args(n, (events,) + args, n_chunks)
+        results = self.pool.map(_call_worker, [(method, chunk) for chunk in chunks], chunksize=1)
+        return join_results(results, np.diff(np.linspace(0, n, n_chunks+1).astype(int)))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('obj', 'pool'):
+            raise AttributeError(name)
+        return functools.partial(self.map, name)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
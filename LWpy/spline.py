@@ -1,43 +1,265 @@
+import os
+import threading
+import numbers
+import collections
+import concurrent.futures
 import numpy as np
+import scipy.ndimage
 import photospline
 
+class tabulated_spline:
+    # Spline values precomputed on a regular grid over the spline extents
+    # evaluate_simple mirrors photospline.SplineTable, interpolating in the grid for values
+    # and deferring to the spline for gradients and points outside the grid
+    orders = {'linear': 1, 'cubic': 3}
+
+    def __init__(self, spline, bins, method='linear', tolerance=None, extents=None, n_check=10000):
+        if method not in tabulated_spline.orders:
+            raise ValueError("Unknown interpolation method " + str(method) + ", options are " + str(list(tabulated_spline.orders.keys())))
+        self.spline = spline
+        self.method = method
+        self.order = tabulated_spline.orders[method]
+        if extents is None:
+            extents = spline.extents
+        self.extents = np.array(extents, dtype=float).reshape((-1, 2))
+        self.ndim = len(self.extents)
+        bins = np.broadcast_to(np.asarray(bins, dtype=int), (self.ndim,))
+        if np.any(bins < 2):
+            raise ValueError("Need at least 2 bins per dimension")
+        self.bins = tuple(bins.tolist())
+        self.lower = self.extents[:,0]
+        self.step = (self.extents[:,1] - self.extents[:,0]) / (bins - 1)
+
+        axes = [np.linspace(lo, hi, n) for (lo, hi), n in zip(self.extents, self.bins)]
+        grid = np.meshgrid(*axes, indexing='ij')
+        coords = np.array([g.reshape(-1) for g in grid])
+        values = np.asarray(spline.evaluate_simple(coords, 0)).reshape(self.bins)
+        # Extend the grid by odd reflection so the cubic prefilter sees smooth boundaries
+        self.pad = 0
+        if self.order > 1:
+            self.pad = min(8, min(self.bins) - 1)
+            values = np.pad(values, self.pad, mode='reflect', reflect_type='odd')
+            values = scipy.ndimage.spline_filter(values, order=self.order, mode='mirror')
+        self.values = values
+
+        self.max_error = None
+        if tolerance is not None:
+            self.max_error = self.check(n_check)
+            if self.max_error > tolerance:
+                raise ValueError("Tabulated spline error " + str(self.max_error) + " exceeds tolerance " + str(tolerance) + ", increase the number of bins")
+
+    def check(self, n):
+        # Maximum absolute deviation from the spline at random points inside the extents
+        rng = np.random.default_rng(0)
+        coords = rng.uniform(self.extents[:,0][:,None], self.extents[:,1][:,None], (self.ndim, n))
+        return np.max(np.abs(self.evaluate_simple(coords) - self.spline.evaluate_simple(coords, 0)))
+
+    def evaluate_simple(self, coords, grad=0):
+        if grad != 0:
+            return self.spline.evaluate_simple(coords, grad)
+        coords = np.asarray(coords, dtype=float)
+        index = (coords - self.lower[:,None]) / self.step[:,None]
+        inside = np.all(np.logical_and(index >= 0, index <= (np.array(self.bins) - 1)[:,None]), axis=0)
+        index += self.pad
+        if np.all(inside):
+            return scipy.ndimage.map_coordinates(self.values, index, order=self.order, mode='mirror', prefilter=False)
+        res = np.empty(coords.shape[1])
+        res[inside] = scipy.ndimage.map_coordinates(self.values, index[:,inside], order=self.order, mode='mirror', prefilter=False)
+        res[~inside] = self.spline.evaluate_simple(coords[:,~inside], 0)
+        return res
+
 class spline_repo_helper(type):
-    splines = dict()
+    # Opened splines by path, least recently used first
+    # max_entries and max_bytes bound the repository, the least recently used splines are dropped beyond them
+    # Sizes are the file size of a spline plus the size of its table
+    splines = collections.OrderedDict()
+    tables = dict()
+    sizes = dict()
+    total_bytes = 0
+    max_entries = None
+    max_bytes = None
+    tabulation = None
+    lock = threading.RLock()
+    # Paths currently being opened or tabulated, a second thread asking for the same path waits for the first one
+    loading = dict()
+
     def __getitem__(cls, item):
-        if item not in spline_repo_helper.splines:
+        with spline_repo_helper.lock:
+            res = spline_repo_helper.cached(item)
+            if res is not None:
+                return res
+            loader = spline_repo_helper.loading.setdefault(item, threading.Lock())
+        # Opening and tabulating happen outside the lock, so lookups of other splines are not held up
+        with loader:
             try:
-                spline = photospline.SplineTable(item)
-                spline_repo_helper.splines[item] = spline
-            except:
-                print(item)
-                raise ValueError("Spline cannot be opened")
-        return spline_repo_helper.splines[item]
+                with spline_repo_helper.lock:
+                    res = spline_repo_helper.cached(item)
+                    if res is not None:
+                        return res
+                    spline = spline_repo_helper.splines.get(item)
+                    tabulation = spline_repo_helper.tabulation
+                if spline is None:
+                    try:
+                        spline = photospline.SplineTable(item)
+                    except Exception as e:
+                        raise ValueError("Spline " + str(item) + " cannot be opened: " + str(e)) from e
+                table = None
+                if spline_repo_helper.tabulated(spline, tabulation):
+                    bins, method, tolerance = tabulation
+                    table = tabulated_spline(spline, bins[spline.ndim], method=method, tolerance=tolerance)
+                with spline_repo_helper.lock:
+                    if item not in spline_repo_helper.splines:
+                        spline_repo_helper.splines[item] = spline
+                        spline_repo_helper.sizes[item] = os.path.getsize(item) if os.path.isfile(item) else 0
+                        spline_repo_helper.total_bytes += spline_repo_helper.sizes[item]
+                    spline_repo_helper.splines.move_to_end(item)
+                    # A table built with settings replaced in the meantime is returned but not kept
+                    if table is not None and tabulation is spline_repo_helper.tabulation:
+                        spline_repo_helper.tables[item] = table
+                        spline_repo_helper.sizes[item] += table.values.nbytes
+                        spline_repo_helper.total_bytes += table.values.nbytes
+                    spline_repo_helper.evict(keep=item)
+                return spline if table is None else table
+            finally:
+                with spline_repo_helper.lock:
+                    if spline_repo_helper.loading.get(item) is loader:
+                        del spline_repo_helper.loading[item]
+
+    @staticmethod
+    def cached(item):
+        # The spline or table served for item if it is ready, None otherwise
+        # Called with the lock held
+        if item not in spline_repo_helper.splines:
+            return None
+        spline = spline_repo_helper.splines[item]
+        if not spline_repo_helper.tabulated(spline, spline_repo_helper.tabulation):
+            spline_repo_helper.splines.move_to_end(item)
+            return spline
+        if item not in spline_repo_helper.tables:
+            return None
+        spline_repo_helper.splines.move_to_end(item)
+        return spline_repo_helper.tables[item]
+
+    @staticmethod
+    def tabulated(spline, tabulation):
+        # Splines of a dimension without bins are evaluated directly
+        return tabulation is not None and spline.ndim in tabulation[0]
+
+    @staticmethod
+    def evict(keep=None):
+        # Drop least recently used splines until the limits hold, never the one just requested
+        # Called with the lock held
+        while len(spline_repo_helper.splines) > 0:
+            over_entries = spline_repo_helper.max_entries is not None and len(spline_repo_helper.splines) > spline_repo_helper.max_entries
+            over_bytes = spline_repo_helper.max_bytes is not None and spline_repo_helper.total_bytes > spline_repo_helper.max_bytes
+            if not (over_entries or over_bytes):
+                break
+            item = next(iter(spline_repo_helper.splines))
+            if item == keep:
+                break
+            del spline_repo_helper.splines[item]
+            spline_repo_helper.tables.pop(item, None)
+            spline_repo_helper.total_bytes -= spline_repo_helper.sizes.pop(item)
+
+    def set_limits(cls, max_entries=None, max_bytes=None):
+        # Bound the number of open splines and their size in bytes, None for no bound
+        if (max_entries is not None and max_entries < 1) or (max_bytes is not None and max_bytes < 0):
+            raise ValueError("Spline repository limits have to be positive")
+        with spline_repo_helper.lock:
+            spline_repo_helper.max_entries = max_entries
+            spline_repo_helper.max_bytes = max_bytes
+            spline_repo_helper.evict()
+
+    def preload(cls, paths, threads=None):
+        # Open the splines of paths in parallel, e.g. at service start
+        paths = list(dict.fromkeys(paths))
+        if len(paths) == 0:
+            return
+        if threads is None:
+            threads = min(len(paths), os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            list(pool.map(lambda path: cls[path], paths))
+
+    def __contains__(cls, item):
+        with spline_repo_helper.lock:
+            return item in spline_repo_helper.splines
+
+    def __len__(cls):
+        with spline_repo_helper.lock:
+            return len(spline_repo_helper.splines)
+
+    def clear(cls):
+        with spline_repo_helper.lock:
+            spline_repo_helper.splines.clear()
+            spline_repo_helper.tables.clear()
+            spline_repo_helper.sizes.clear()
+            spline_repo_helper.total_bytes = 0
+
+    def set_tabulation(cls, bins=None, method='linear', tolerance=None):
+        # Serve splines from precomputed tables, bins maps the spline dimension to the grid resolution
+        # Splines of dimensions missing from bins are served directly
+        # Pass bins=None to go back to evaluating the splines directly
+        with spline_repo_helper.lock:
+            for item, table in spline_repo_helper.tables.items():
+                spline_repo_helper.sizes[item] -= table.values.nbytes
+                spline_repo_helper.total_bytes -= table.values.nbytes
+            spline_repo_helper.tables = dict()
+            if bins is None:
+                spline_repo_helper.tabulation = None
+            else:
+                if method not in tabulated_spline.orders:
+                    raise ValueError("Unknown interpolation method " + str(method))
+                spline_repo_helper.tabulation = (dict(bins), method, tolerance)
 
 class spline_repo(object, metaclass=spline_repo_helper):
     pass
 
-def eval_spline(spline, coords, grad=None):
-    if np.shape(coords) == 2:
-        coords = coords.T
+def gradient_mask(grad, ndim):
+    # Bit mask of the dimensions to differentiate in, as photospline expects
+    # grad is None for the value, a dimension, or an iterable of dimensions
     if grad is None:
-        return spline.evaluate_simple(coords, 0)
+        return 0
+    if isinstance(grad, (numbers.Integral, np.integer)):
+        dims = [int(grad)]
     else:
         try:
-            grad = int(grad)
-            assert(grad < len(coords))
-            grad = 0x1 << grad
-            return spline.evaluate_simple(coords, grad)
-        except:
-            try:
-                grad = list(grad)
-                res = 0x0
-                for i in range(np.shape(coords)[0]):
-                    if i in grad:
-                        res |= (0x1 << i)
-                return spline.evaluate_simple(coords, res)
-            except:
-                try:
-                    return spline.evaluate_simple(coords, grad)
-                except:
-                    raise ValueError("Could not interpret grad!")
+            dims = [int(d) for d in grad]
+        except (TypeError, ValueError):
+            raise ValueError("Could not interpret grad!")
+    res = 0x0
+    for d in dims:
+        if d < 0 or d >= ndim:
+            raise ValueError("Gradient dimension " + str(d) + " out of range for a spline of dimension " + str(ndim))
+        res |= (0x1 << d)
+    return res
+
+class bound_spline:
+    # A spline with a fixed gradient specification, called with (ndim, N) coordinates
+    # The gradient mask is worked out once, float64 C contiguous coordinates are passed on without a copy
+    # With gradients=True a call returns the value and the gradients in every dimension, shape (ndim, N)
+    def __init__(self, spline, grad=None, gradients=False):
+        self.spline = spline
+        self.ndim = spline.ndim
+        self.mask = gradient_mask(grad, self.ndim)
+        self.gradients = gradients
+        self.evaluate = spline.evaluate_simple
 
+    def __call__(self, coords):
+        coords = np.asarray(coords, dtype=float)
+        if coords.ndim == 1 and self.ndim == 1:
+            coords = coords[None,:]
+        if coords.ndim != 2 or coords.shape[0] != self.ndim:
+            raise ValueError("Expected coordinates of shape (" + str(self.ndim) + ", N), got " + str(coords.shape))
+        if not coords.flags.c_contiguous:
+            coords = np.ascontiguousarray(coords)
+        if not self.gradients:
+            return self.evaluate(coords, self.mask)
+        value = self.evaluate(coords, 0)
+        grads = np.empty((self.ndim, coords.shape[1]))
+        for d in range(self.ndim):
+            grads[d] = self.evaluate(coords, 0x1 << d)
+        return value, grads
+
+def eval_spline(spline, coords, grad=None):
+    # coords has shape (ndim, N), bind the spline with bound_spline when it is evaluated repeatedly
+    return bound_spline(spline, grad)(coords)
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import uuid
+
+def temporary_file(path):
+    # New file next to path for writing it and renaming it into place, returns (fd, temporary path)
+    # Created with mode 0o666 so the umask applies as for any new file, unlike mkstemp which only grants access to the owner
+    while True:
+        tmp = os.path.join(os.path.dirname(path) or '.', '.' + os.path.basename(path) + '.' + uuid.uuid4().hex + '.tmp')
+        try:
+            return os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), tmp
+        except FileExistsError:
+            pass
+
+def atomic_write(path, data):
+    # Write to a temporary file in the same directory and rename it into place
+    fd, tmp = temporary_file(path)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+class spline_store:
+    # Content addressed spline files in spline_dir, named by the SHA-512 of their data
+    # Distinct spline data is hashed once per process; a blob is recognized again by comparing it with the
+    # stored files of the same size, so no spline data is kept in memory
+    # Files listed in the manifest were verified before and are not read again
+    # Files and the manifest are written to a temporary file and renamed, so concurrent readers never see partial files
+    stores = dict()
+    manifest_name = "manifest.json"
+
+    @staticmethod
+    def get(spline_dir):
+        key = os.path.abspath(spline_dir)
+        if key not in spline_store.stores:
+            spline_store.stores[key] = spline_store(spline_dir)
+        return spline_store.stores[key]
+
+    def __init__(self, spline_dir):
+        self.spline_dir = spline_dir
+        self.index = dict()
+        self.verified = set()
+        self.manifest = self.read_manifest()
+
+    def path(self, name):
+        return os.path.join(self.spline_dir, name)
+
+    def read_manifest(self):
+        try:
+            f = open(self.path(spline_store.manifest_name), 'r')
+            try:
+                return dict(json.load(f))
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def record(self, name, size):
+        # Merge with the manifest on disk so entries written by other jobs are kept
+        self.manifest = dict(self.read_manifest(), **self.manifest)
+        self.manifest[name] = size
+        data = json.dumps(self.manifest, sort_keys=True, indent=0).encode('ascii')
+        atomic_write(self.path(spline_store.manifest_name), data)
+
+    @staticmethod
+    def file_hash(path, block_size=1<<20):
+        h = hashlib.sha512()
+        f = open(path, 'rb')
+        try:
+            for data in iter(lambda: f.read(block_size), b''):
+                h.update(data)
+        finally:
+            f.close()
+        return h.hexdigest()
+
+    def lookup(self, data):
+        for name in self.index.get(len(data), []):
+            try:
+                f = open(self.path(name), 'rb')
+                try:
+                    if f.read() == data:
+                        return name
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                pass
+        return None
+
+    def add(self, data):
+        # Store the spline data if needed and return its file name
+        name = self.lookup(data)
+        if name is None:
+            data = bytes(data)
+            name = hashlib.sha512(data).hexdigest() + '.fits'
+            self.index.setdefault(len(data), []).append(name)
+        if name not in self.verified:
+            self.store(name, data)
+            self.verified.add(name)
+        return name
+
+    def store(self, name, data):
+        path = self.path(name)
+        size = len(data)
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            if self.manifest.get(name) == size:
+                return
+            if spline_store.file_hash(path) + '.fits' == name:
+                self.record(name, size)
+                return
+        atomic_write(path, data)
+        self.record(name, size)
@@ -0,0 +1,38 @@
+from context import LWpy
+import LWpy.benchmarks
+import unittest
+import json
+import os
+import numpy as np
+
+class BenchmarkTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_synthetic_lic(self):
+        blocks = LWpy.benchmarks.make_lic('./synthetic.lic', 6, distinct=3, events=10)
+        try:
+            with LWpy.read_stream('./synthetic.lic', index_only=True) as s:
+                read_blocks = s.read()
+            # Blocks are compared by the digest of their splines, which are read from the file
+            merged = LWpy.merge_blocks(read_blocks)
+        finally:
+            os.remove('./synthetic.lic')
+        assert(len(read_blocks) == len(blocks))
+        assert(len(merged) == 4)
+        assert(sum(d["events"] for s, v, d in merged if s != "EnumDef") == 60)
+
+    def test_suite(self):
+        events = LWpy.benchmarks.make_events(1000, energy_range=(1e3, 1e4), zenith_range=(0.0, 1.0), seed=1)
+        assert(np.all(events["energy"] >= 1e3) and np.all(events["energy"] <= 1e4))
+        assert(np.all(events["zenith"] <= 1.0))
+        with LWpy.benchmarks.suite(events=1000, blocks=4, distinct=2) as s:
+            names = ["generator.prob", "read_stream.read_index", "merge_blocks"]
+            results = s.run(names, repeat=1)
+            data = json.loads(json.dumps(LWpy.benchmarks.benchmark.report(results, s.parameters())))
+        assert(sorted(data["results"].keys()) == sorted(names))
+        for name in names:
+            assert(data["results"][name]["items_per_second"] > 0)
+            assert(data["results"][name]["peak_memory_bytes"] > 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,9 @@ from context import LWpy
 import unittest
 import EarthModelService
 import LeptonInjector
+import numpy as np
+import warnings
+from LWpy.earth import lepton_range_table
 
 class GeneratorTests(unittest.TestCase):
     """Basic test cases."""
@@ -39,6 +42,87 @@ class GeneratorTests(unittest.TestCase):
             1480.0*LeptonInjector.Constants.m]
         LWpy.earth(earth_model_params)
 
+    def test_lepton_range(self):
+        energy = 10**np.random.uniform(0, 9, 10000)
+        for isTau in [False, True]:
+            r0 = LWpy.earth.GetLeptonRange(energy, isTau=isTau, tolerance=None)
+            r1 = LWpy.earth.GetLeptonRange(energy, isTau=isTau, tolerance=1e-6)
+            assert(np.all(np.abs(r1/r0 - 1.0) < 1e-5))
+        cgs = LWpy.earth.MWEtoColumnDepthCGS(r0)
+        assert(np.allclose(cgs, [EarthModelService.EarthModelCalculator.MWEtoColumnDepthCGS(r) for r in r0]))
+        assert(np.allclose(LWpy.earth.ColumnDepthCGStoMWE(cgs), r0))
+
+    def test_lepton_range_refinement(self):
+        class kinked(lepton_range_table):
+            calls = [0]
+            @staticmethod
+            def direct(energy, isTau, option, scale):
+                energy = np.asarray(energy, dtype=float)
+                kinked.calls[0] += len(energy)
+                # Kink at 1e4 GeV and a jump at 1e8 GeV
+                return energy**0.8 * np.maximum(1.0, energy/1e4)**0.3 * np.where(energy < 1e8, 1.0, 2.0)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            table = kinked(False, None, 1.0, tolerance=1e-6)
+        assert(len(w) == 1)
+        # Only the intervals around the kink and the jump are refined
+        assert(kinked.calls[0] < 1e4)
+        assert(np.count_nonzero(table.direct_intervals) == 1)
+        energy = 10**np.random.uniform(-1, 12, 10000)
+        assert(np.all(np.abs(table(energy) / kinked.direct(energy, False, None, 1.0) - 1.0) < 1e-5))
+
+    def test_numpy_backend(self):
+        earth_model_params = [
+            "DUNE",
+            "../resources/earthparams/",
+            ["PREM_dune"],
+            ["Standard"],
+            "NoIce",
+            20.0*LeptonInjector.Constants.degrees,
+            1480.0*LeptonInjector.Constants.m]
+        ems = LWpy.earth(earth_model_params)
+        npe = LWpy.earth(earth_model_params, backend="numpy")
+
+        n = 100
+        p0 = np.random.normal(size=(n, 3)) * 1e6
+        p1 = np.random.normal(size=(n, 3)) * 1e6
+        p0 = np.array([LeptonInjector.LI_Position(*p) for p in p0])
+        p1 = np.array([LeptonInjector.LI_Position(*p) for p in p1])
+
+        for use_electron_density in [False, True]:
+            c0 = ems.GetColumnDepthInCGS(p0, p1, use_electron_density)
+            c1 = npe.GetColumnDepthInCGS(p0, p1, use_electron_density)
+            assert(np.all(np.abs(c1/c0 - 1) < 1e-6))
+
+        assert(np.all(np.abs(npe.GetDensityInCGS(p0) / ems.GetDensityInCGS(p0) - 1) < 1e-6))
+        assert(np.all(np.abs(npe.GetPNERatio(p0) / ems.GetPNERatio(p0) - 1) < 1e-6))
+
+    def test_column_depth_table(self):
+        earth_model_params = [
+            "DUNE",
+            "../resources/earthparams/",
+            ["PREM_dune"],
+            ["Standard"],
+            "NoIce",
+            20.0*LeptonInjector.Constants.degrees,
+            1480.0*LeptonInjector.Constants.m]
+        npe = LWpy.earth(earth_model_params, backend="numpy")
+        table = LWpy.column_depth_table(npe)
+        for use_electron_density in [False, True]:
+            forward, inverse = table.check(1000, use_electron_density)
+            assert(forward < 1e-4)
+            assert(inverse < 1e-4)
+
+        p0 = np.random.normal(size=(100, 3)) * 1e6
+        p1 = np.random.normal(size=(100, 3)) * 1e6
+        c0 = npe.GetColumnDepthInCGS(p0, p1)
+        assert(npe.tabulate_column_depth(table) is table)
+        c1 = npe.GetColumnDepthInCGS(p0, p1)
+        assert(np.all(np.abs(c1 - c0) < 1e-4 * np.max(c0)))
+        # The check still compares with the earth model once the table is installed
+        forward, inverse = table.check(1000)
+        assert(0 < forward < 1e-4)
+
 
 if __name__ == '__main__':
     unittest.main()
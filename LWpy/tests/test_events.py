@@ -61,5 +61,67 @@ class EventTests(unittest.TestCase):
         gen_pos = gen.prob_pos(props)
         p_int = int_model.prob_interaction(props, first_pos, last_pos)
 
+    def test_event_file(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        gen = LWpy.volume_generator(blocks[1])
+
+        data_file = h5.File("data_output_DUNE.h5")
+        injector_list = [i for i in data_file.keys()]
+        with LWpy.event_file("data_output_DUNE.h5", chunk_size=1000) as f:
+            assert(f.groups() == injector_list)
+            for i in injector_list:
+                props = data_file[i]["properties"][:]
+                res = np.concatenate([gen.prob(events) for start, events in f.chunks(i)])
+                props.dtype.names = f.names
+                names = props.dtype.names
+                formats = [(s,v) for s,v in props.dtype.descr if s in names]
+                formats += [('x', '<f8'), ('y', '<f8')]
+                a = [props[n] for n in names]
+                a += [np.zeros(len(props)), np.zeros(len(props))]
+                props = np.array(list(zip(*a)), dtype=formats)
+                assert(np.array_equal(res, gen.prob(props)))
+
+    def test_event_batch(self):
+        events = np.zeros(100, dtype=[('energy', 'f8'), ('zenith', 'f8'), ('particle', 'i4')])
+        events['energy'] = np.arange(100)
+        events['zenith'] = np.linspace(0, np.pi, 100)
+        batch = LWpy.event_batch(events)
+        assert(len(batch) == 100)
+        assert(np.array_equal(batch['energy'], events['energy']))
+
+        sub = batch[batch['energy'] % 2 == 0]
+        assert(len(sub) == 50)
+        assert(np.array_equal(sub['energy'], events['energy'][::2]))
+        # Columns are gathered from the columns the parent already read
+        assert(np.shares_memory(sub.parent.columns['energy'], events))
+        sub = sub[np.arange(10, 20)]
+        assert(np.array_equal(sub['zenith'], events['zenith'][::2][10:20]))
+        assert(np.array_equal(sub.records(), events[::2][10:20]))
+        assert(np.array_equal(LWpy.event_batch(sub)['energy'], sub['energy']))
+
+    def test_event_batch_derived(self):
+        n = 20
+        columns = {
+                'energy': np.logspace(1, 3, n),
+                'zenith': np.linspace(0, np.pi, n),
+                'azimuth': np.zeros(n),
+                'particle': np.full(n, 14),
+                'final_type_0': np.full(n, -2000001006),
+                'final_type_1': np.full(n, 13),
+                }
+        batch = LWpy.event_batch(columns)
+        assert('log10_energy' in batch and 'energy' in batch.names)
+        assert(np.allclose(batch['log10_energy'], np.linspace(1, 3, n)))
+        assert(np.allclose(batch['direction'].z, np.cos(columns['zenith'])))
+        assert(np.array_equal(batch['signature'][0], [14, -2000001006, 13]))
+        # Derived columns of a selection are gathered from the parent
+        sub = batch[5:10]
+        assert(np.array_equal(sub['log10_energy'], batch['log10_energy'][5:10]))
+        records = sub.records()
+        assert(np.array_equal(records['energy'], columns['energy'][5:10]))
+        assert(np.array_equal(LWpy.event_batch(records)['signature'], sub['signature']))
+
+
 if __name__ == '__main__':
     unittest.main()
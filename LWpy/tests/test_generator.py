@@ -246,6 +246,35 @@ class GeneratorTests(unittest.TestCase):
             mask = gen.inside_volume(events)
             gen.prob_area(events[mask])
 
+    def test_volume_generator_range(self):
+        s, blocks, gen = make_volume_generator()
+        block = blocks[1][2]
+        radius = block["radius"]
+        height = block["height"]
+        n = 4
+        events = np.array(list(zip(
+            np.zeros(n),
+            np.zeros(n),
+            np.array([0.0, 0.25, 0.0, -0.25])*height,
+            np.array([0.0, np.pi, np.pi/2., np.pi/2.]),
+            np.zeros(n))),
+            dtype=[
+                ('x', 'f8'),
+                ('y', 'f8'),
+                ('z', 'f8'),
+                ('zenith', 'f8'),
+                ('azimuth', 'f8'),
+                ])
+        first_pos, last_pos = gen.get_considered_range(events)
+        length = (last_pos - first_pos).magnitude()
+        assert(np.allclose(length, [height, height, 2*radius, 2*radius]))
+        # Ranges are ordered along the direction
+        direction = LWpy.vector3.from_angles(events["zenith"], events["azimuth"])
+        assert(np.all((last_pos - first_pos).dot(direction) > 0))
+
+        events["x"] = 2*radius
+        self.assertRaises(LWpy.geometry_error, gen.get_considered_range, events)
+
     def test_ranged_generator_init(self):
         s, blocks, gen = make_ranged_generator()
 
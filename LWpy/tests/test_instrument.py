@@ -0,0 +1,46 @@
+from context import LWpy
+import LWpy.benchmarks
+import unittest
+import numpy as np
+
+class InstrumentTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_generator_stages(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        gen = LWpy.volume_generator(blocks[1])
+        events = LWpy.benchmarks.make_events(1000, radius=1.0, height=1.0, seed=0)
+        events["zenith"][:100] = 4.0
+
+        p0 = gen.prob(events)
+        with LWpy.profiler(memory=True) as prof:
+            p1 = gen.prob(events)
+        assert(np.array_equal(p0, p1))
+        assert(len(LWpy.instrument.callbacks) == 0)
+
+        summary = prof.summary()
+        for stage in ["prob", "prob_final_state", "prob_stat", "prob_dir", "prob_e", "prob_ranges", "prob_area", "prob_pos", "prob_kinematics"]:
+            assert(summary["volume_generator." + stage]["calls"] == 1)
+            assert(summary["volume_generator." + stage]["bytes"] is not None)
+        assert(summary["volume_generator.prob_dir"]["events_in"] == 1000)
+        assert(summary["volume_generator.prob_dir"]["events_out"] == 900)
+        assert(summary["volume_generator.prob_e"]["events_in"] == 900)
+        assert(summary["volume_generator.prob"]["events_out"] == np.count_nonzero(p0))
+
+    def test_callback(self):
+        records = []
+        LWpy.instrument.add_callback(records.append)
+        try:
+            res = LWpy.instrument.stage("test", lambda events: events != 0, np.arange(10))
+        finally:
+            LWpy.instrument.remove_callback(records.append)
+        assert(len(records) == 1)
+        assert(records[0]["stage"] == "test")
+        assert(records[0]["events_in"] == 10 and records[0]["events_out"] == 9)
+        assert(records[0]["bytes"] is None)
+        LWpy.instrument.stage("test", lambda events: events, np.arange(10))
+        assert(len(records) == 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,41 @@
 from context import LWpy
 from context import standard_interactions
+from LWpy.benchmarks import make_events as make_positioned_events
 import unittest
 import LeptonInjector
+import numpy as np
+
+earth_model_params = [
+    "DUNE",
+    "../resources/earthparams/",
+    ["PREM_dune"],
+    ["Standard"],
+    "NoIce",
+    20.0*LeptonInjector.Constants.degrees,
+    1480.0*LeptonInjector.Constants.m]
+
+def make_events(n):
+    particle = np.full(n, int(LeptonInjector.Particle.ParticleType.NuMu))
+    final_type_0 = np.full(n, int(LeptonInjector.Particle.ParticleType.MuMinus))
+    final_type_1 = np.full(n, int(LeptonInjector.Particle.ParticleType.Hadrons))
+    energy = 10**np.random.uniform(2, 6, n)
+    bjorken_x = np.random.uniform(0.01, 1.0, n)
+    bjorken_y = np.random.uniform(0.01, 1.0, n)
+    return np.array(list(zip(
+        energy,
+        final_type_0,
+        final_type_1,
+        particle,
+        bjorken_x,
+        bjorken_y)),
+        dtype=[
+            ('energy', 'f8'),
+            ('final_type_0', 'i4'),
+            ('final_type_1', 'i4'),
+            ('particle', 'i4'),
+            ('bjorken_x', 'f8'),
+            ('bjorken_y', 'f8'),
+            ])
 
 class InteractionTests(unittest.TestCase):
     """Basic test cases."""
@@ -33,6 +67,62 @@ class InteractionTests(unittest.TestCase):
         ints = nu_interactions.get_particle_interactions(LeptonInjector.Particle.ParticleType.NuEBar)
         print([i.name for i in ints])
 
+    def test_signature_codes(self):
+        nu_interactions_list = standard_interactions.get_standard_interactions()
+        nu_interactions = LWpy.interactions(nu_interactions_list)
+        table = nu_interactions.signature_table
+        assert(len(table) == len(nu_interactions.interactions_by_signature))
+        signature = table[np.random.randint(0, len(table), 1000)]
+        codes = nu_interactions.signature_codes(signature)
+        assert(np.array_equal(table[codes], signature))
+        signature[0, 0] = 0
+        signature[1, 1:] = signature[1, 1:][::-1] - 1
+        codes = nu_interactions.signature_codes(signature)
+        assert(codes[0] == -1 and codes[1] == -1 and np.all(codes[2:] >= 0))
+
+    def test_evaluate_by_file(self):
+        calls = []
+        def evaluate(coords):
+            calls.append(coords.shape[1])
+            return coords[0] * 2
+        coords = np.arange(10.0)[None,:]
+        a = np.array([0, 3, 5])
+        b = np.array([1, 2])
+        work = [("nc.fits", evaluate, "a", a), ("nc.fits", evaluate, "b", b), ("cc.fits", evaluate, "c", a)]
+        res = LWpy.interaction_model.evaluate_by_file(work, coords)
+        assert(calls == [5, 3])
+        for key, index in [("a", a), ("b", b), ("c", a)]:
+            assert(np.array_equal(res[key], 2 * coords[0, index]))
+
+    def test_context_cache(self):
+        nu_interactions_list = standard_interactions.get_standard_interactions()
+        int_model = LWpy.interaction_model(nu_interactions_list, earth_model_params)
+        events = make_events(1000)
+        p0, e0 = int_model.get_total_cross_section(events)
+        ctx = int_model.context(events)
+        assert(int_model.context(events) is ctx)
+        int_model.prob_kinematics(events)
+        assert(int_model.context(events) is ctx)
+
+        events["energy"] *= 2
+        assert(int_model.context(events) is not ctx)
+        p1, e1 = int_model.get_total_cross_section(events)
+        assert(not np.all(p0 == p1))
+
+    def test_context_positions(self):
+        # Positions edited in place are not served from the cached context
+        nu_interactions_list = standard_interactions.get_standard_interactions()
+        int_model = LWpy.interaction_model(nu_interactions_list, earth_model_params, earth_backend="numpy")
+        events = make_positioned_events(100, seed=1)
+        position = LWpy.vector3.from_components(events["x"], events["y"], events["z"])
+        direction = LWpy.vector3.from_angles(events["zenith"], events["azimuth"])
+        first_pos, last_pos = position - 1e3*direction, position + 1e3*direction
+        int_model.prob_pos(events, first_pos, last_pos)
+        events["z"] += 10.0
+        p = int_model.prob_pos(events, first_pos, last_pos)
+        fresh = LWpy.interaction_model(nu_interactions_list, earth_model_params, earth_backend="numpy")
+        assert(np.array_equal(p, fresh.prob_pos(events.copy(), first_pos, last_pos)))
+
 #    def get_particle_interactions(self, particle):
 #        if particle in self.interactions_by_particle:
 #            return self.interactions_by_particle[particle]
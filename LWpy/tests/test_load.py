@@ -1,5 +1,10 @@
 from context import LWpy
 import unittest
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
 
 class LicStreamLoad(unittest.TestCase):
     """Basic test cases."""
@@ -15,6 +20,56 @@ class LicStreamLoad(unittest.TestCase):
         blocks = LWpy.merge_blocks(blocks)
         assert(len(blocks) == 2)
 
+    def test_merge(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        merged = LWpy.merge_blocks(blocks + blocks + blocks)
+        assert(len(merged) == 2)
+        assert(merged[1][2]["events"] == 3*blocks[1][2]["events"])
+        merger = LWpy.block_merger()
+        merger.add_files(['./config_DUNE.lic', './config_DUNE.lic'])
+        merged = merger.blocks()
+        assert(len(merged) == 2)
+        assert(merged[1][2]["events"] == 2*blocks[1][2]["events"])
+
+    def test_merge_cli(self):
+        from LWpy.merge import main
+        output = os.path.join(tempfile.mkdtemp(), 'merged.lic')
+        assert(main(['./config_DUNE.lic', './config_DUNE.lic', '-o', output, '-j', '2']) == 0)
+        blocks = LWpy.read_stream('./config_DUNE.lic').read()
+        merged = LWpy.read_stream(output).read()
+        assert(len(merged) == 2)
+        assert(merged[1][2]["events"] == 2*blocks[1][2]["events"])
+        shutil.rmtree(os.path.dirname(output))
+
+    def test_config_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        blocks = LWpy.read_stream('./config_DUNE.lic').read()
+        for i in range(2):
+            cache = LWpy.config_cache(cache_dir)
+            cached_blocks, constants = cache.read('./config_DUNE.lic')
+            assert(len(cached_blocks) == len(blocks))
+            for b0, b1 in zip(blocks, cached_blocks):
+                assert(LWpy.block_equal(b0, b1))
+            assert(constants[1] == LWpy.generator.block_constants(blocks[1][0], blocks[1][2]))
+        # A warm start does not hash the file contents again unless the file changes
+        fname = os.path.join(cache_dir, 'config.lic')
+        shutil.copy('./config_DUNE.lic', fname)
+        cache.read(fname)
+        with mock.patch.object(LWpy.spline_store, 'file_hash', side_effect=AssertionError):
+            cache.read(fname)
+        st = os.stat(fname)
+        os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        with mock.patch.object(LWpy.spline_store, 'file_hash', wraps=LWpy.spline_store.file_hash) as file_hash:
+            cache.read(fname)
+            assert(file_hash.call_count == 1)
+        # Entries referring to classes that no longer exist are dropped
+        path = cache.path("lic", "stale")
+        open(path, 'wb').write(b"cnot_a_module\nthing\n.")
+        assert(cache.load(path) is None)
+        assert(not os.path.exists(path))
+        shutil.rmtree(cache_dir)
+
     def test_read_write(self):
         s = LWpy.read_stream('./config_DUNE.lic')
         blocks = s.read()
@@ -26,5 +81,45 @@ class LicStreamLoad(unittest.TestCase):
         for i in range(len(blocks)):
             assert(LWpy.block_equal(blocks[i], new_blocks[i]))
 
+    def test_write_file_object(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        LWpy.write_stream('./test_config.lic').write(blocks)
+        f = io.BytesIO()
+        LWpy.write_stream(f).write(blocks)
+        assert(f.getvalue() == open('./test_config.lic', 'rb').read())
+
+    def test_index_only(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        with LWpy.read_stream('./config_DUNE.lic', index_only=True) as ss:
+            index_blocks = ss.read()
+        assert(len(index_blocks) == len(blocks))
+        for b0, b1 in zip(blocks, index_blocks):
+            if b0[0] == 'EnumDef':
+                assert(LWpy.block_equal(b0, b1))
+                continue
+            for k in b0[2].keys():
+                if isinstance(b1[2][k], LWpy.spline_blob):
+                    assert(b1[2][k].materialize('./') == b0[2][k])
+                else:
+                    assert(b0[2][k] == b1[2][k])
+
+    def test_spline_store(self):
+        spline_dir = tempfile.mkdtemp()
+        s = LWpy.read_stream('./config_DUNE.lic', spline_dir=spline_dir)
+        blocks = s.read()
+        store = LWpy.spline_store.get(spline_dir)
+        names = [blocks[1][2]["totalCrossSection"], blocks[1][2]["differentialCrossSection"]]
+        for name in names:
+            assert(name in store.verified)
+            assert(store.manifest[name] == os.path.getsize(os.path.join(spline_dir, name)))
+        new_blocks = LWpy.read_stream('./config_DUNE.lic', spline_dir=spline_dir).read()
+        assert(LWpy.block_equal(blocks[1], new_blocks[1]))
+        # Blobs are recognized again from the stored files, the store keeps no spline data
+        assert(store.lookup(open(os.path.join(spline_dir, names[0]), 'rb').read()) == names[0])
+        assert(all(isinstance(n, str) for n in sum(store.index.values(), [])))
+        shutil.rmtree(spline_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+from context import LWpy
+from context import standard_interactions
+import unittest
+import LeptonInjector
+import numpy as np
+from LWpy.parallel import join_results
+
+earth_model_params = [
+    "DUNE",
+    "../resources/earthparams/",
+    ["PREM_dune"],
+    ["Standard"],
+    "NoIce",
+    20.0*LeptonInjector.Constants.degrees,
+    1480.0*LeptonInjector.Constants.m]
+
+def make_events(n):
+    names = ['energy', 'zenith', 'azimuth', 'bjorken_x', 'bjorken_y', 'final_type_0', 'final_type_1', 'particle', 'x', 'y', 'z']
+    events = np.zeros(n, dtype=[(k, 'i4' if k in ['final_type_0', 'final_type_1', 'particle'] else 'f8') for k in names])
+    events["energy"] = 10**np.random.uniform(2, 6, n)
+    events["zenith"] = np.arccos(np.random.uniform(-1, 1, n))
+    events["azimuth"] = np.random.uniform(0, 2*np.pi, n)
+    events["bjorken_x"] = np.random.uniform(0.01, 1.0, n)
+    events["bjorken_y"] = np.random.uniform(0.01, 1.0, n)
+    events["final_type_0"] = int(LeptonInjector.Particle.ParticleType.MuMinus)
+    events["final_type_1"] = int(LeptonInjector.Particle.ParticleType.Hadrons)
+    events["particle"] = int(LeptonInjector.Particle.ParticleType.NuMu)
+    events["x"] = np.random.normal(size=n)*100
+    events["y"] = np.random.normal(size=n)*100
+    events["z"] = np.random.normal(size=n)*100
+    return events
+
+class ParallelTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_parallel_generator(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        events = make_events(5000)
+        gen = LWpy.volume_generator(blocks[1])
+        with LWpy.parallel(LWpy.volume_generator, blocks[1], workers=2, chunk_size=1000) as p:
+            p0 = p.prob(events)
+            p1 = p.prob(events)
+        assert(np.array_equal(p0, p1))
+        assert(np.allclose(p0, gen.prob(events)))
+
+    def test_parallel_scalar(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        events = make_events(5000)
+        gen = LWpy.volume_generator(blocks[1])
+        with LWpy.parallel(LWpy.volume_generator, blocks[1], workers=2, chunk_size=1000) as p:
+            p_stat = p.prob_stat(events)
+        assert(np.ndim(p_stat) == 0 and p_stat == gen.prob_stat(events))
+        joined = join_results([2.0, np.array([1.0, 3.0])], [3, 2])
+        assert(np.array_equal(joined, [2.0, 2.0, 2.0, 1.0, 3.0]))
+
+    def test_parallel_interactions(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        events = make_events(5000)
+        gen = LWpy.volume_generator(blocks[1])
+        events = events[gen.inside_volume(events)]
+        first_pos, last_pos = gen.get_considered_range(events)
+        int_model = LWpy.interaction_model(standard_interactions.get_standard_interactions(), earth_model_params)
+        with LWpy.parallel(LWpy.interaction_model, standard_interactions.get_standard_interactions(), earth_model_params, workers=2, chunk_size=1000) as p:
+            assert(np.allclose(p.prob_kinematics(events), int_model.prob_kinematics(events)))
+            assert(np.allclose(p.prob_pos(events, first_pos, last_pos), int_model.prob_pos(events, first_pos, last_pos)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from context import LWpy
+from LWpy.spline import spline_repo, tabulated_spline, bound_spline, eval_spline
+import unittest
+import threading
+from unittest import mock
+import numpy as np
+
+total_xs = "../resources/crosssections/csms_differential_v1.0/sigma_nu_CC_iso.fits"
+differential_xs = "../resources/crosssections/csms_differential_v1.0/dsdxdy_nu_CC_iso.fits"
+
+class SplineTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_tabulated_total(self):
+        spline = spline_repo[total_xs]
+        table = tabulated_spline(spline, 4096, method='cubic', tolerance=1e-3)
+        lo, hi = spline.extents[0]
+        coords = np.random.uniform(lo, hi, (1, 1000))
+        assert(np.all(np.abs(table.evaluate_simple(coords) - spline.evaluate_simple(coords, 0)) < 1e-3))
+
+    def test_tabulated_tolerance(self):
+        spline = spline_repo[differential_xs]
+        with self.assertRaises(ValueError):
+            tabulated_spline(spline, 3, tolerance=1e-12)
+
+    def test_repo_tabulation(self):
+        spline_repo.set_tabulation({1: 4096, 3: (64, 64, 64)}, method='linear')
+        try:
+            assert(isinstance(spline_repo[total_xs], tabulated_spline))
+        finally:
+            spline_repo.set_tabulation(None)
+        assert(not isinstance(spline_repo[total_xs], tabulated_spline))
+        # Only the dimensions with bins are tabulated
+        spline_repo.set_tabulation({3: (16, 16, 16)})
+        try:
+            assert(not isinstance(spline_repo[total_xs], tabulated_spline))
+            assert(isinstance(spline_repo[differential_xs], tabulated_spline))
+        finally:
+            spline_repo.set_tabulation(None)
+
+    def test_repo_limits(self):
+        spline_repo.clear()
+        spline_repo.preload([total_xs, differential_xs, total_xs], threads=2)
+        assert(total_xs in spline_repo and differential_xs in spline_repo)
+        try:
+            spline_repo[total_xs]
+            spline_repo.set_limits(max_entries=1)
+            # The least recently used spline is dropped
+            assert(len(spline_repo) == 1 and total_xs in spline_repo)
+            spline = spline_repo[differential_xs]
+            assert(len(spline_repo) == 1 and differential_xs in spline_repo)
+            assert(spline_repo[differential_xs] is spline)
+        finally:
+            spline_repo.set_limits(None)
+
+    def test_repo_concurrent_tabulation(self):
+        # Tables are built outside the repository lock, other splines are served meanwhile
+        spline_repo.clear()
+        spline_repo[differential_xs]
+        started = threading.Event()
+        release = threading.Event()
+        init = tabulated_spline.__init__
+        def slow_init(self, *args, **kwargs):
+            started.set()
+            release.wait(10)
+            init(self, *args, **kwargs)
+        spline_repo.set_tabulation({1: 64, 3: (4, 4, 4)})
+        try:
+            with mock.patch.object(tabulated_spline, '__init__', slow_init):
+                res = []
+                thread = threading.Thread(target=lambda: res.append(spline_repo[total_xs]))
+                thread.start()
+                assert(started.wait(10))
+                other = []
+                def lookup():
+                    spline_repo.set_tabulation(None)
+                    other.append(spline_repo[differential_xs])
+                lookup_thread = threading.Thread(target=lookup)
+                lookup_thread.start()
+                lookup_thread.join(5)
+                assert(len(other) == 1)
+                release.set()
+                thread.join()
+            # Built for settings replaced in the meantime, returned but not kept
+            assert(isinstance(res[0], tabulated_spline))
+            assert(len(spline_repo.tables) == 0)
+        finally:
+            release.set()
+            spline_repo.set_tabulation(None)
+
+    def test_bound_spline(self):
+        spline = spline_repo[differential_xs]
+        coords = np.random.uniform(-2, 0, (3, 100))
+        coords[0] += 4
+        evaluate = bound_spline(spline, grad=[0, 2])
+        assert(evaluate.mask == 0b101)
+        assert(np.array_equal(evaluate(coords), spline.evaluate_simple(coords, 0b101)))
+        assert(np.array_equal(eval_spline(spline, coords, grad=1), spline.evaluate_simple(coords, 0b10)))
+        value, grads = bound_spline(spline, gradients=True)(coords)
+        assert(np.array_equal(value, spline.evaluate_simple(coords, 0)))
+        assert(grads.shape == (3, 100))
+        assert(np.array_equal(grads[2], spline.evaluate_simple(coords, 0b100)))
+        with self.assertRaises(ValueError):
+            evaluate(coords.T)
+        with self.assertRaises(ValueError):
+            bound_spline(spline, grad=3)
+
+if __name__ == '__main__':
+    unittest.main()
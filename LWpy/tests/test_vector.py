@@ -0,0 +1,36 @@
+from context import LWpy
+import unittest
+import LeptonInjector
+import numpy as np
+
+class VectorTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_li_round_trip(self):
+        n = 100
+        xyz = np.random.normal(size=(n, 3))
+        v = LWpy.vector3(xyz)
+        li = v.to_li_positions()
+        assert(np.allclose(LWpy.vector3.from_li(li).xyz, xyz))
+
+    def test_directions(self):
+        n = 100
+        zenith = np.random.uniform(0, np.pi, n)
+        azimuth = np.random.uniform(0, 2*np.pi, n)
+        d = LWpy.vector3.from_angles(zenith, azimuth)
+        li = np.array([LeptonInjector.LI_Direction(zen, azi) for zen, azi in zip(zenith, azimuth)])
+        assert(np.allclose(LWpy.vector3.from_li(li).xyz, d.xyz))
+        assert(np.allclose(d.magnitude(), 1.0))
+
+    def test_pca(self):
+        n = 100
+        zenith = np.random.uniform(0, np.pi, n)
+        azimuth = np.random.uniform(0, 2*np.pi, n)
+        d = LWpy.vector3.from_angles(zenith, azimuth)
+        p = LWpy.vector3(np.random.normal(size=(n, 3)))
+        pca = LWpy.earth.get_pca(d, p)
+        assert(np.allclose(pca * d, 0.0))
+        assert(np.allclose((pca - p - (pca - p).dot(d) * d).magnitude(), 0.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+from context import LWpy
+from context import standard_interactions
+import unittest
+import LeptonInjector
+import numpy as np
+
+earth_model_params = [
+    "DUNE",
+    "../resources/earthparams/",
+    ["PREM_dune"],
+    ["Standard"],
+    "NoIce",
+    20.0*LeptonInjector.Constants.degrees,
+    1480.0*LeptonInjector.Constants.m]
+
+def make_events(block, n):
+    energy = np.random.uniform(block["energy_min"], block["energy_max"], n)
+    zenith = np.random.uniform(block["zenith_min"], block["zenith_max"], n)
+    azimuth = np.random.uniform(block["azimuth_min"], block["azimuth_max"], n)
+    r = block["radius"] * np.sqrt(np.random.uniform(0, 0.9, n))
+    phi = np.random.uniform(0, 2*np.pi, n)
+    z = np.random.uniform(-0.45, 0.45, n) * block["height"]
+    return np.array(list(zip(
+        energy,
+        zenith,
+        azimuth,
+        np.random.uniform(0.01, 1.0, n),
+        np.random.uniform(0.01, 1.0, n),
+        np.full(n, block["final_type_0"]),
+        np.full(n, block["final_type_1"]),
+        np.full(n, int(LeptonInjector.Particle.ParticleType.NuMu)),
+        r*np.cos(phi),
+        r*np.sin(phi),
+        z)),
+        dtype=[
+            ('energy', 'f8'),
+            ('zenith', 'f8'),
+            ('azimuth', 'f8'),
+            ('bjorken_x', 'f8'),
+            ('bjorken_y', 'f8'),
+            ('final_type_0', 'i4'),
+            ('final_type_1', 'i4'),
+            ('particle', 'i4'),
+            ('x', 'f8'),
+            ('y', 'f8'),
+            ('z', 'f8'),
+            ])
+
+class WeighterTests(unittest.TestCase):
+    """Basic test cases."""
+
+    def test_prob_gen(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        int_model = LWpy.interaction_model(standard_interactions.get_standard_interactions(), earth_model_params)
+        w = LWpy.weighter(blocks + blocks, int_model, earth_model_params)
+        assert(len(w.generators) == 1)
+        events = make_events(blocks[1][2], 1000)
+        p0 = w.prob_gen(events)
+        p1 = w.generators[0].prob(events)
+        assert(np.allclose(p0, p1))
+
+    def test_weight(self):
+        s = LWpy.read_stream('./config_DUNE.lic')
+        blocks = s.read()
+        int_model = LWpy.interaction_model(standard_interactions.get_standard_interactions(), earth_model_params)
+        w = LWpy.weighter(blocks, int_model, earth_model_params)
+        events = make_events(blocks[1][2], 1000)
+        weights = w.weight(events)
+        assert(np.all(weights >= 0))
+        assert(np.all(np.isfinite(weights)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import numpy as np
+import LeptonInjector
+
+class vector3:
+    # Batch of 3-vectors stored as a contiguous (N,3) float64 array
+    # Defer numpy binary operators so that array * vector3 scales the vectors
+    __array_ufunc__ = None
+
+    def __init__(self, xyz):
+        xyz = np.ascontiguousarray(xyz, dtype=float)
+        if xyz.ndim == 1:
+            xyz = xyz.reshape((-1, 3))
+        if xyz.ndim != 2 or xyz.shape[1] != 3:
+            raise ValueError("Expected an (N,3) array, got shape " + str(xyz.shape))
+        self.xyz = xyz
+
+    @staticmethod
+    def from_components(x, y, z):
+        return vector3(np.stack(np.broadcast_arrays(
+            np.asarray(x, dtype=float),
+            np.asarray(y, dtype=float),
+            np.asarray(z, dtype=float)), axis=-1).reshape((-1, 3)))
+
+    @staticmethod
+    def from_angles(zenith, azimuth):
+        # Same convention as LeptonInjector.LI_Direction(zenith, azimuth)
+        zenith = np.asarray(zenith, dtype=float)
+        azimuth = np.asarray(azimuth, dtype=float)
+        sin_zenith = np.sin(zenith)
+        return vector3.from_components(np.cos(azimuth)*sin_zenith, np.sin(azimuth)*sin_zenith, np.cos(zenith))
+
+    @staticmethod
+    def from_li(objs):
+        # Accepts arrays of LI_Position or LI_Direction
+        objs = np.asarray(objs).reshape(-1)
+        if len(objs) > 0 and isinstance(objs[0], LeptonInjector.LI_Direction):
+            objs = [1.0*o for o in objs]
+        return vector3(np.array([[o.GetX(), o.GetY(), o.GetZ()] for o in objs], dtype=float).reshape((-1, 3)))
+
+    @staticmethod
+    def as_vector3(v):
+        if isinstance(v, vector3):
+            return v
+        v = np.asarray(v)
+        if v.dtype == object:
+            return vector3.from_li(v)
+        return vector3(v)
+
+    def to_li_positions(self):
+        return np.array([LeptonInjector.LI_Position(*p) for p in self.xyz.tolist()])
+
+    def to_li_directions(self):
+        zenith, azimuth = self.angles()
+        return np.array([LeptonInjector.LI_Direction(zen, azi) for zen, azi in zip(zenith.tolist(), azimuth.tolist())])
+
+    @property
+    def x(self):
+        return self.xyz[:,0]
+
+    @property
+    def y(self):
+        return self.xyz[:,1]
+
+    @property
+    def z(self):
+        return self.xyz[:,2]
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def __getitem__(self, item):
+        return vector3(self.xyz[item])
+
+    def __setitem__(self, item, value):
+        self.xyz[item] = vector3.as_vector3(value).xyz
+
+    def __iter__(self):
+        return iter(self.xyz)
+
+    def copy(self):
+        return vector3(self.xyz.copy())
+
+    @staticmethod
+    def _other(other):
+        if isinstance(other, vector3):
+            return other.xyz
+        other = np.asarray(other, dtype=float)
+        if other.shape == (3,):
+            return other[None,:]
+        return other
+
+    @staticmethod
+    def _scalar(s):
+        s = np.asarray(s, dtype=float)
+        if s.ndim == 1:
+            return s[:,None]
+        return s
+
+    def __add__(self, other):
+        return vector3(self.xyz + vector3._other(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return vector3(self.xyz - vector3._other(other))
+
+    def __rsub__(self, other):
+        return vector3(vector3._other(other) - self.xyz)
+
+    def __neg__(self):
+        return vector3(-self.xyz)
+
+    def __mul__(self, other):
+        # vector * vector is the dot product, as for LI_Direction * LI_Position
+        if isinstance(other, vector3):
+            return self.dot(other)
+        return vector3(self.xyz * vector3._scalar(other))
+
+    def __rmul__(self, other):
+        return vector3(self.xyz * vector3._scalar(other))
+
+    def __truediv__(self, other):
+        return vector3(self.xyz / vector3._scalar(other))
+
+    def dot(self, other):
+        return np.einsum('ij,ij->i', self.xyz, np.broadcast_to(vector3._other(other), self.xyz.shape))
+
+    def magnitude(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.xyz, self.xyz))
+
+    def normalized(self):
+        m = self.magnitude()
+        return vector3(self.xyz / np.where(m > 0, m, 1.0)[:,None])
+
+    def angles(self):
+        # zenith, azimuth of the direction
+        m = self.magnitude()
+        zenith = np.arccos(np.clip(self.z / np.where(m > 0, m, 1.0), -1.0, 1.0))
+        azimuth = np.mod(np.arctan2(self.y, self.x), 2*np.pi)
+        return zenith, azimuth
+
+    @staticmethod
+    def pca(direction, position, origin=(0,0,0)):
+        # Point of closest approach to origin along the lines position + t*direction
+        direction = vector3.as_vector3(direction)
+        position = vector3.as_vector3(position)
+        return (direction * (origin - position)) * direction + position
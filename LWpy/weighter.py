@@ -0,0 +1,121 @@
+from .block import merge_blocks
+from .generator import volume_generator
+from .generator import ranged_generator
+from .generator import generator
+from .event_batch import event_batch, as_events
+import os.path
+import numpy as np
+
+class weighter:
+    def __init__(self, blocks, int_model, earth_model_params=None, spline_dir='./', earth_backend="EarthModelService"):
+        self.int_model = int_model
+        self.spline_dir = spline_dir
+        self.generators = []
+        earth_model = None
+        for block in merge_blocks(blocks):
+            block_name, block_version, block_data = block
+            if block_name == "VolumeInjectionConfiguration":
+                gen = volume_generator(block, spline_dir=spline_dir)
+            elif block_name == "RangedInjectionConfiguration":
+                # All ranged generators share one earth model
+                gen = ranged_generator(block, earth_model_params, spline_dir=spline_dir, earth_backend=earth_backend, earth_model=earth_model)
+                earth_model = gen.earthModel
+            else:
+                continue
+            self.generators.append(gen)
+
+    def kinematics_key(self, gen):
+        return (os.path.join(self.spline_dir, gen.differential_xs), os.path.join(self.spline_dir, gen.total_xs))
+
+    @staticmethod
+    def union_index(generators, probs, key):
+        # Events with a nonzero probability in any generator sharing the same key
+        groups = dict()
+        for gen, p in zip(generators, probs):
+            k = key(gen)
+            if k not in groups:
+                groups[k] = (gen, np.zeros(len(p), dtype=bool))
+            groups[k][1][p != 0] = True
+        return dict([(k, (gen, np.nonzero(mask)[0])) for k, (gen, mask) in groups.items()])
+
+    def generation_terms(self, events):
+        # Generation probability of every generator
+        # Considered ranges and generator kinematics are computed once for each distinct geometry and
+        # pair of cross section splines, on the events that need them
+        # Returns the per generator probabilities and, for every geometry, (event index, first_pos, last_pos)
+        # Columns are gathered once and shared by all generators, see generator.prob
+        events = event_batch(events)
+        probs = []
+        for gen in self.generators:
+            p = gen.prob_final_state(events)
+            p *= gen.prob_stat(events)
+            index = np.flatnonzero(p)
+            sub_events = events[index]
+            p[index] *= gen.prob_dir(sub_events)
+            index, sub_events = generator.compact(p, index, sub_events)
+            p[index] *= gen.prob_e(sub_events)
+            index, sub_events = generator.compact(p, index, sub_events)
+            p[index[~gen.contains(sub_events)]] = 0
+            probs.append(p)
+
+        ranges = dict()
+        for key, (gen, index) in weighter.union_index(self.generators, probs, lambda g: g.geometry_key()).items():
+            first_pos, last_pos = gen.get_considered_range(events[index])
+            ranges[key] = (index, first_pos, last_pos)
+
+        for gen, p in zip(self.generators, probs):
+            index, first_pos, last_pos = ranges[gen.geometry_key()]
+            sub_events = events[index]
+            p[index] *= gen.prob_area(sub_events, first_pos, last_pos) * gen.prob_pos(sub_events, first_pos, last_pos)
+
+        for key, (gen, index) in weighter.union_index(self.generators, probs, self.kinematics_key).items():
+            kinematics = gen.prob_kinematics(events[index])
+            for g, p in zip(self.generators, probs):
+                if self.kinematics_key(g) == key:
+                    p[index] *= kinematics
+
+        return probs, ranges
+
+    def prob_gen(self, events):
+        # Total generation probability summed over all blocks
+        probs, ranges = self.generation_terms(events)
+        res = np.zeros(len(events))
+        for p in probs:
+            res += p
+        return res
+
+    def prob_phys(self, events, first_pos, last_pos):
+        # Physical probability of the events given their considered range
+        ctx = self.int_model.context(events)
+        p = self.int_model.prob_kinematics(ctx) * self.int_model.prob_final_state(ctx)
+        return p * self.int_model.prob_interaction(ctx, first_pos, last_pos) * self.int_model.prob_pos(ctx, first_pos, last_pos)
+
+    def weight(self, events):
+        # One weight: 1 / sum_i(p_gen_i / p_phys_i), where p_phys_i uses the considered range of generator i
+        # Multiply by the flux to get a rate
+        # The generators and the interaction model share one batch, so derived columns are computed once
+        events = as_events(events)
+        probs, ranges = self.generation_terms(events)
+        ctx = self.int_model.context(events)
+
+        # Geometry independent physical terms are shared by every range
+        p_xs = self.int_model.prob_kinematics(ctx) * self.int_model.prob_final_state(ctx)
+
+        p_phys = dict()
+        for key, (index, first_pos, last_pos) in ranges.items():
+            sub = ctx.subset(index)
+            p_range = self.int_model.prob_interaction(sub, first_pos, last_pos) * self.int_model.prob_pos(sub, first_pos, last_pos)
+            p_phys[key] = p_xs[index] * p_range
+
+        inverse = np.zeros(len(events))
+        for gen, p in zip(self.generators, probs):
+            key = gen.geometry_key()
+            index = ranges[key][0]
+            p_gen = p[index]
+            nonzero = p_gen != 0
+            inverse[index[nonzero]] += p_gen[nonzero] / p_phys[key][nonzero]
+
+        res = np.zeros(len(events))
+        nonzero = inverse > 0
+        res[nonzero] = 1.0 / inverse[nonzero]
+        return res
@@ -7,7 +7,7 @@ setup(name='LWpy',
       author='Austin Schneider',
       author_email='physics.schneider@gmail.com',
       license='L-GPL-2.1',
-      packages=['LWpy', 'LWpy/generator', 'LWpy/resources', 'LWpy/tests'],
+      packages=['LWpy', 'LWpy/generator', 'LWpy/benchmarks', 'LWpy/resources', 'LWpy/tests'],
       package_data={'LWpy': [
           'resources/crosssections/csms_differential_v1.0/*.fits',
           'resources/earthparams/materials/*.dat',
@@ -15,4 +15,8 @@ setup(name='LWpy',
           'resources/interactions/*.py',
           ]},
       include_package_data=True,
+      entry_points={'console_scripts': [
+          'lwpy-merge=LWpy.merge:main',
+          'lwpy-benchmark=LWpy.benchmarks.benchmark:main',
+          ]},
       zip_safe=False)